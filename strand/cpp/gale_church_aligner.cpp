@@ -8,21 +8,44 @@ using std::cout;
 using std::endl;
 
 double GaleChurchAligner::align(vector<int>& source, vector<int>& target,
-    vector<AlignmentBead>* alignment) {
+    vector<AlignmentBead>* alignment, int band) {
   s_size = source.size();
   t_size = target.size();
-  double* grid = new double[idx(s_size, t_size)+1];
-  int8_t* backpointers = new int8_t[idx(s_size, t_size)+1];
+  // The band follows the diagonal from (0, 0) to (s_size, t_size). It is
+  // widened by the slope of the diagonal, so that consecutive rows overlap
+  // and the end cell can be reached when the target is much longer.
+  row_start.resize(s_size + 2);
+  t_min.resize(s_size + 1);
+  t_max.resize(s_size + 1);
+  row_start[0] = 0;
+  long width = 0;
+  if (s_size > 0) {
+    width = band + (t_size + s_size - 1) / s_size - 1;
+  }
+  for (int s = 0; s <= s_size; ++s) {
+    if ((band > 0) && (s_size > 0)) {
+      long center = ((long) s * t_size) / s_size;
+      t_min[s] = std::max(0L, center - width);
+      t_max[s] = std::min((long) t_size, center + width + 1);
+    } else {
+      t_min[s] = 0;
+      t_max[s] = t_size;
+    }
+    row_start[s + 1] = row_start[s] + t_max[s] - t_min[s] + 1;
+  }
+  double* grid = new double[row_start[s_size + 1]];
+  int8_t* backpointers = new int8_t[row_start[s_size + 1]];
   for (int s = 0; s <= s_size; ++s) {
-    for (int t = 0; t <= t_size; ++t) {
+    for (int t = t_min[s]; t <= t_max[s]; ++t) {
       double best_score = -std::numeric_limits<double>::max();
+      backpointers[idx(s,t)] = -1;
       if ((s == 0) && (t == 0)) {
         best_score = 0.0;
       }
       for (int a = 0; a < ALIGNMENT_TYPES; ++a) {
         int old_s = s - alignment_types[a].s;
         int old_t = t - alignment_types[a].t;
-        if ((old_s < 0) || (old_t < 0)) {
+        if ((old_s < 0) || (old_t < 0) || !in_band(old_s, old_t)) {
           continue;
         }
         double score = grid[idx(old_s, old_t)] + alignment_types[a].cost;
@@ -49,7 +72,7 @@ double GaleChurchAligner::align(vector<int>& source, vector<int>& target,
   int s = s_size;
   int t = t_size;
   alignment->clear();
-  while ((s > 0) && (t > 0)) {
+  while ((s > 0) && (t > 0) && (backpointers[idx(s,t)] >= 0)) {
     AlignmentType at = alignment_types[backpointers[idx(s,t)] ];
     AlignmentBead bead;
     bead.s_start = s - at.s;
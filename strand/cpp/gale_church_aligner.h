@@ -46,16 +46,26 @@ class GaleChurchAligner {
   // Aligns the source and target vectors containing the lengths of the
   // sentences, populates the alignment vector, and returns the cost of the
   // alignment. Each item in the alignment is a pair of source and target
-  // ranges.
+  // ranges. If band is positive, only the cells within band sentences of the
+  // diagonal (plus its slope, when the target is longer) are searched (and
+  // stored), which makes aligning whole documents linear instead of quadratic
+  // in their length.
   double align(vector<int>& source, vector<int>& target,
-      vector<AlignmentBead>* alignment);
+      vector<AlignmentBead>* alignment, int band = 0);
  
  private:
-  inline int idx(int s, int t) {
-    return (s * (t_size + 1)) + t;
+  // Cells of row s are stored for t in [t_min[s], t_max[s]] only
+  inline long idx(int s, int t) {
+    return row_start[s] + t - t_min[s];
+  }
+  inline bool in_band(int s, int t) {
+    return (t >= t_min[s]) && (t <= t_max[s]);
   }
   int s_size;
   int t_size;
+  vector<long> row_start;
+  vector<int> t_min;
+  vector<int> t_max;
   // The costs for 0-1, 1-0, 1-1 (etc.) alignments.
   AlignmentType alignment_types[ALIGNMENT_TYPES];
 
@@ -9,7 +9,7 @@ import re
 cdef extern from "cpp/aligner.h":
   cdef cppclass Aligner:
     Aligner() except +
-    int align(vector[int]&, vector[int]&, vector[pair[int, int] ]*)
+    int align(vector[int]&, vector[int]&, vector[pair[int, int] ]*) except +
     int s_size, t_size
 
 cdef extern from "cpp/gale_church_aligner.h":
@@ -20,7 +20,7 @@ cdef extern from "cpp/gale_church_aligner.h":
     int t_end
   cdef cppclass GaleChurchAligner:
     GaleChurchAligner() except +
-    double align(vector[int]&, vector[int]&, vector[AlignmentBead]*)
+    double align(vector[int]&, vector[int]&, vector[AlignmentBead]*, int) except +
 
 cdef class PyAligner:
   cdef Aligner *thisptr
@@ -54,8 +54,9 @@ cdef class PyGaleChurchAligner:
     del self.thisptr
   # Returns a tuple: (alignment_cost, source_sentences, target_sentences)
   # where the source and target sentences are lists of the same length that have
-  # been aligned (one side may contain empty strings)
-  def align(self, source, target):
+  # been aligned (one side may contain empty strings). A positive band limits
+  # the search to alignments within band sentences of the diagonal.
+  def align(self, source, target, band=0):
     remove_ws = re.compile(r"[\s\r\n]+");
     cdef vector[int] source_vec
     for sent in source:
@@ -64,7 +65,7 @@ cdef class PyGaleChurchAligner:
     for sent in target:
       target_vec.push_back(len(remove_ws.sub("", sent)))
     cdef vector[AlignmentBead] alignment
-    cdef double cost = self.thisptr.align(source_vec, target_vec, &alignment)
+    cdef double cost = self.thisptr.align(source_vec, target_vec, &alignment, band)
     aligned_source = []
     aligned_target = []
     cdef int i, s, t
@@ -13,7 +13,11 @@ setup(
   name='strand',
   version='0.0.1',
   packages=find_packages(),
+  install_requires=[
+    'numpy'
+  ],
   scripts=[
-    'strand-align'
+    'strand-align',
+    'strand-candidates'
   ]
 )
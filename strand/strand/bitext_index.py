@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+# bitext_index.py
+#
+# A binary index over the bitext (.<pair>) and annotation (.<pair>.ann) files
+# written by strand-align, mapping each document pair to byte offsets so that
+# its alignments can be fetched with a single seek.
+#
+# Layout (all integers little endian):
+#   header:  magic "STRX", version (u32), record count (u64), table offset (u64)
+#   records: one per document pair, in output order:
+#            key hash (u64), bitext offset (u64), bitext length (u64),
+#            annotation offset (u64), annotation length (u32),
+#            number of alignments (u32), line offset (u64)
+#   table:   (key hash (u64), record number (u64)) sorted by hash, used to look
+#            up a document pair by its URLs
+
+import hashlib
+import mmap
+import struct
+
+from collections import namedtuple
+
+MAGIC = b"STRX"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQ")
+RECORD = struct.Struct("<QQQQIIQ")
+TABLE_ENTRY = struct.Struct("<QQ")
+
+IndexEntry = namedtuple("IndexEntry", ["key_hash", "bi_offset", "bi_length", "ann_offset",
+                                       "ann_length", "num_alignments", "line_offset"])
+
+
+# A stable 64 bit hash of a document pair's URLs
+def pair_key_hash(source_url, target_url):
+    digest = hashlib.blake2b((source_url + "\t" + target_url).encode("utf-8"),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class BitextIndexWriter:
+    def __init__(self, path):
+        self.out = open(path, mode="wb")
+        self.out.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        self.keys = []
+
+    # Adds the next document pair. Offsets and lengths are in bytes, except for
+    # line_offset which is the line number used in the .ann file.
+    def add(self, source_url, target_url, bi_offset, bi_length, ann_offset, ann_length,
+            num_alignments, line_offset):
+        self.add_entry(IndexEntry(pair_key_hash(source_url, target_url), bi_offset, bi_length,
+                                  ann_offset, ann_length, num_alignments, line_offset))
+
+    def add_entry(self, entry):
+        self.out.write(RECORD.pack(*entry))
+        self.keys.append((entry.key_hash, len(self.keys)))
+
+    def close(self):
+        table_offset = self.out.tell()
+        self.keys.sort()
+        for key in self.keys:
+            self.out.write(TABLE_ENTRY.pack(*key))
+        self.out.seek(0)
+        self.out.write(HEADER.pack(MAGIC, VERSION, len(self.keys), table_offset))
+        self.out.close()
+
+
+# Memory maps an index and (optionally) its bitext and annotation files.
+class BitextIndex:
+    def __init__(self, index_path, bitext_path=None, ann_path=None):
+        self.files = []
+        self.index = self.map_file(index_path)
+        (magic, version, self.count, self.table_offset) = HEADER.unpack_from(self.index, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Not a bitext index: %s" % index_path)
+        self.bitext = self.map_file(bitext_path) if bitext_path else None
+        self.ann = self.map_file(ann_path) if ann_path else None
+
+    def map_file(self, path):
+        f = open(path, mode="rb")
+        self.files.append(f)
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            return b""
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("index record out of range")
+        return IndexEntry(*RECORD.unpack_from(self.index, HEADER.size + i * RECORD.size))
+
+    def __iter__(self):
+        for i in range(0, self.count):
+            yield self[i]
+
+    # Returns the record numbers of all document pairs with the given URLs
+    def lookup(self, source_url, target_url):
+        key_hash = pair_key_hash(source_url, target_url)
+        (lo, hi) = (0, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (h, _) = TABLE_ENTRY.unpack_from(self.index, self.table_offset + mid * TABLE_ENTRY.size)
+            if h < key_hash:
+                lo = mid + 1
+            else:
+                hi = mid
+        result = []
+        for pos in range(lo, self.count):
+            (h, record) = TABLE_ENTRY.unpack_from(self.index, self.table_offset + pos * TABLE_ENTRY.size)
+            if h != key_hash:
+                break
+            # Rule out hash collisions when the annotation file is available
+            if self.ann is None or self.annotation(record)[0:2] == [source_url, target_url]:
+                result.append(record)
+        return result
+
+    # Returns the first record for the given URLs, or None
+    def find(self, source_url, target_url):
+        records = self.lookup(source_url, target_url)
+        if len(records) == 0:
+            return None
+        return self[records[0]]
+
+    # The raw bytes of a record's bitext lines
+    def bitext_bytes(self, i):
+        if self.bitext is None:
+            raise Exception("No bitext file given")
+        entry = self[i]
+        return self.bitext[entry.bi_offset:entry.bi_offset + entry.bi_length]
+
+    # The bitext lines of a record, each split into its tab-separated fields
+    def alignments(self, i):
+        data = self.bitext_bytes(i).decode("utf-8")
+        return [line.split("\t") for line in data.split("\n") if len(line) > 0]
+
+    # The .ann line of a record split into its tab-separated fields
+    def annotation(self, i):
+        if self.ann is None:
+            raise Exception("No annotation file given")
+        entry = self[i]
+        data = self.ann[entry.ann_offset:entry.ann_offset + entry.ann_length]
+        return data.decode("utf-8").rstrip("\n").split("\t")
+
+    def close(self):
+        for m in (self.index, self.bitext, self.ann):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self.files:
+            f.close()
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+# candidates.py
+#
+# Candidate document pair discovery with MinHash and locality sensitive
+# hashing. Every page is reduced to the structural tag/chunk sequence used by
+# STRAND (tags are kept, chunks become a single CHUNK token), the sequence is
+# shingled, and pages whose MinHash signatures collide in at least one LSH band
+# are paired up across languages.
+#
+# Memory stays bounded regardless of the number of pages: the pages,
+# signatures and band keys are spilled to a work directory in a first pass,
+# and the band keys are hash partitioned so that the second pass only holds
+# one partition in memory at a time.
+
+import hashlib
+import os
+import zlib
+
+import numpy as np
+
+from lxml import etree
+
+from strand import parsers
+from strand.pipeline import apply_parser, decode_html_field
+
+# Hash values are taken modulo a 31 bit prime so that a * x + b fits in 64 bits
+MERSENNE_PRIME = (1 << 31) - 1
+BUCKET_DTYPE = np.dtype([("key", "<u8"), ("page", "<u4"), ("band", "<u2")])
+META_DTYPE = np.dtype([("entry", "<u4"), ("lang", "<u2")])
+
+# Matches the tag lines of the StrandTarget output
+TAG_PREFIXES = ("[START:", "[END:")
+
+
+class CandidateFinder:
+    def __init__(self, work_dir, num_perm=128, bands=32, shingle_size=5, partitions=64,
+                 seed=1, align_href=False, b64=False, buffer_size=16384):
+        if num_perm % bands != 0:
+            raise Exception("The number of permutations (%d) must be a multiple of the number of bands (%d)"
+                            % (num_perm, bands))
+        self.work_dir = work_dir
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.partitions = partitions
+        self.align_href = align_href
+        self.b64 = b64
+        self.buffer_size = buffer_size
+        # Parameters of the (a * x + b) mod p hash functions
+        rng = np.random.RandomState(seed)
+        self.perm_a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.perm_b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        os.makedirs(work_dir, exist_ok=True)
+        self.pages_out = open(self.path("pages.tsv"), mode="wb")
+        self.offsets_out = open(self.path("offsets.bin"), mode="wb")
+        self.meta_out = open(self.path("meta.bin"), mode="wb")
+        self.signatures_out = open(self.path("signatures.bin"), mode="wb")
+        self.bucket_files = [open(self.path("buckets-%03d.bin" % p), mode="wb")
+                             for p in range(0, partitions)]
+        # Fixed size record buffers per partition (partitions * buffer_size
+        # records of BUCKET_DTYPE.itemsize bytes)
+        self.bucket_buffers = np.empty((partitions, buffer_size), dtype=BUCKET_DTYPE)
+        self.bucket_counts = [0] * partitions
+        self.languages = {}
+        self.num_pages = 0
+        self.num_entries = 0
+
+    def path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    # First pass: adds every page of an entry line (in the strand-align input
+    # format). Returns the number of pages added.
+    def add_entry(self, line):
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 4 or ((len(fields) - 1) % 3) != 0:
+            return 0
+        entry_id = self.num_entries
+        self.num_entries += 1
+        added = 0
+        for offset in range(1, len(fields) - 2, 3):
+            if self.add_page(entry_id, fields[offset], fields[offset+1], fields[offset+2]):
+                added += 1
+        return added
+
+    # Adds a single page, keeping the raw (still encoded) HTML field for the
+    # output. Returns False if the page could not be parsed.
+    def add_page(self, entry_id, lang, url, html_field):
+        try:
+            tokens = self.structure(decode_html_field(html_field, self.b64), lang)
+        except Exception:
+            return False
+        if len(tokens) == 0:
+            return False
+        signature = self.signature(tokens)
+        page_id = self.num_pages
+        self.num_pages += 1
+
+        if lang not in self.languages:
+            self.languages[lang] = len(self.languages)
+        self.offsets_out.write(np.uint64(self.pages_out.tell()).tobytes())
+        self.pages_out.write(("%s\t%s\t%s\n" % (lang, url, html_field)).encode("utf-8"))
+        self.meta_out.write(np.array([(entry_id, self.languages[lang])], dtype=META_DTYPE).tobytes())
+        self.signatures_out.write(signature.astype("<u8").tobytes())
+
+        for (band, key) in enumerate(self.band_keys(signature)):
+            p = key % self.partitions
+            self.bucket_buffers[p][self.bucket_counts[p]] = (key, page_id, band)
+            self.bucket_counts[p] += 1
+            if self.bucket_counts[p] >= self.buffer_size:
+                self.flush_partition(p)
+        return True
+
+    def flush_partition(self, p):
+        if self.bucket_counts[p] > 0:
+            self.bucket_files[p].write(self.bucket_buffers[p][:self.bucket_counts[p]].tobytes())
+            self.bucket_counts[p] = 0
+
+    # The structural token sequence of a page: tags as they appear in the
+    # StrandTarget output, with every chunk replaced by the same token
+    def structure(self, html, lang):
+        parser = etree.HTMLParser(encoding="utf-8", target=parsers.StrandTarget(lang, self.align_href))
+        tokens = []
+        for line in apply_parser(html, parser).split("\n"):
+            if len(line) == 0:
+                continue
+            if line.startswith(TAG_PREFIXES) and line.endswith("]"):
+                tokens.append(line)
+            else:
+                tokens.append("CHUNK")
+        return tokens
+
+    # MinHash signature over the hashed shingles of a token sequence
+    def signature(self, tokens):
+        token_hashes = np.array([zlib.crc32(t.encode("utf-8")) for t in tokens], dtype=np.uint64)
+        k = min(self.shingle_size, len(token_hashes))
+        # Polynomial hash of every window of k tokens (wrapping arithmetic)
+        shingles = np.zeros(len(token_hashes) - k + 1, dtype=np.uint64)
+        for j in range(0, k):
+            shingles = shingles * np.uint64(1000003) + token_hashes[j:len(token_hashes) - k + 1 + j]
+        shingles = np.unique(shingles % np.uint64(MERSENNE_PRIME))
+
+        signature = np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        # Bounded blocks keep the (permutations x shingles) matrix small
+        for start in range(0, len(shingles), 4096):
+            block = shingles[start:start + 4096]
+            hashed = (self.perm_a[:, None] * block[None, :] + self.perm_b[:, None]) % np.uint64(MERSENNE_PRIME)
+            signature = np.minimum(signature, hashed.min(axis=1))
+        return signature
+
+    def band_keys(self, signature):
+        return [self.band_key(signature, band) for band in range(0, self.bands)]
+
+    def band_key(self, signature, band):
+        rows = signature[band * self.rows:(band + 1) * self.rows].astype("<u8")
+        digest = hashlib.blake2b(band.to_bytes(2, "little") + rows.tobytes(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    # Ends the first pass
+    def close(self):
+        for p in range(0, self.partitions):
+            self.flush_partition(p)
+            self.bucket_files[p].close()
+        for f in (self.pages_out, self.offsets_out, self.meta_out, self.signatures_out):
+            f.close()
+
+    # The keys of the buckets with more than max_bucket pages, over all
+    # partitions (only boilerplate structures end up in such buckets, so the
+    # set stays small)
+    def oversized_buckets(self, max_bucket=100):
+        oversized = set()
+        for p in range(0, self.partitions):
+            buckets = np.fromfile(self.path("buckets-%03d.bin" % p), dtype=BUCKET_DTYPE)
+            (keys, counts) = np.unique(buckets["key"], return_counts=True)
+            oversized.update(int(key) for key in keys[counts > max_bucket])
+        return oversized
+
+    # Second pass: yields (page id, page id, estimated similarity) for every
+    # pair of pages in different languages (one of them in target_lang, if
+    # given) whose signatures collide in a band. Each pair is only reported
+    # from the first band it collides in whose bucket was not skipped: buckets
+    # with more than max_bucket pages (boilerplate pages) are skipped.
+    def candidates(self, threshold=0.5, max_bucket=100, target_lang="en", exclude_same_entry=True):
+        if self.num_pages == 0:
+            return
+        signatures = np.memmap(self.path("signatures.bin"), dtype="<u8", mode="r",
+                               shape=(self.num_pages, self.num_perm))
+        meta = np.memmap(self.path("meta.bin"), dtype=META_DTYPE, mode="r")
+        target_code = self.languages.get(target_lang, -1) if target_lang else None
+        oversized = self.oversized_buckets(max_bucket)
+        for p in range(0, self.partitions):
+            buckets = np.fromfile(self.path("buckets-%03d.bin" % p), dtype=BUCKET_DTYPE)
+            if len(buckets) == 0:
+                continue
+            buckets = buckets[np.argsort(buckets["key"], kind="stable")]
+            boundaries = np.flatnonzero(np.diff(buckets["key"])) + 1
+            for group in np.split(buckets, boundaries):
+                if len(group) < 2 or len(group) > max_bucket:
+                    continue
+                band = int(group["band"][0])
+                pages = group["page"]
+                for a in range(0, len(pages)):
+                    for b in range(a + 1, len(pages)):
+                        (i, j) = (int(pages[a]), int(pages[b]))
+                        (meta_i, meta_j) = (meta[i], meta[j])
+                        if meta_i["lang"] == meta_j["lang"]:
+                            continue
+                        if target_code is not None and target_code not in (meta_i["lang"], meta_j["lang"]):
+                            continue
+                        if exclude_same_entry and meta_i["entry"] == meta_j["entry"]:
+                            continue
+                        (sig_i, sig_j) = (signatures[i], signatures[j])
+                        if band > 0 and self.reported_earlier(sig_i, sig_j, band, oversized):
+                            continue
+                        similarity = float(np.mean(sig_i == sig_j))
+                        if similarity >= threshold:
+                            yield (i, j, similarity)
+
+    # True if two signatures already collide in a band before the given one
+    # whose bucket was not skipped for being oversized
+    def reported_earlier(self, sig_i, sig_j, band, oversized):
+        earlier = (sig_i[:band * self.rows] == sig_j[:band * self.rows]).reshape(band, self.rows).all(axis=1)
+        for b in np.flatnonzero(earlier):
+            if self.band_key(sig_i, int(b)) not in oversized:
+                return True
+        return False
+
+    # Returns (language, url, raw HTML field) of a page
+    def page(self, page_id, pages_in=None, offsets=None):
+        if offsets is None:
+            offsets = np.memmap(self.path("offsets.bin"), dtype="<u8", mode="r")
+        close = pages_in is None
+        if pages_in is None:
+            pages_in = open(self.path("pages.tsv"), mode="rb")
+        pages_in.seek(int(offsets[page_id]))
+        fields = pages_in.readline().decode("utf-8").rstrip("\n").split("\t")
+        if close:
+            pages_in.close()
+        return tuple(fields)
+
+    # Writes the candidates as strand-align entries (one pair per line, with
+    # the target language page last). Returns the number of pairs written.
+    def write_entries(self, out_file, target_lang="en", **kwargs):
+        offsets = np.memmap(self.path("offsets.bin"), dtype="<u8", mode="r")
+        count = 0
+        with open(self.path("pages.tsv"), mode="rb") as pages_in:
+            for (i, j, similarity) in self.candidates(target_lang=target_lang, **kwargs):
+                first = self.page(i, pages_in, offsets)
+                second = self.page(j, pages_in, offsets)
+                if first[0] == target_lang:
+                    (first, second) = (second, first)
+                key = "minhash:%.3f:%s" % (similarity, first[1])
+                out_file.write(("\t".join((key,) + first + second) + "\n").encode("utf-8"))
+                count += 1
+        return count
+
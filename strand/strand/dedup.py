@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+# dedup.py
+#
+# Fixed-size structures for dropping repeated sentence pairs (menus, footers,
+# language switchers) from the bitext output: a Bloom filter remembers which
+# pairs were already written, and an optional count-min sketch estimates how
+# often each pair occurred.
+
+import base64
+import hashlib
+import math
+
+from array import array
+
+
+# Returns two 64 bit hashes of a digest, used for double hashing
+def split_digest(digest):
+    return (int.from_bytes(digest[0:8], "little"), int.from_bytes(digest[8:16], "little") | 1)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        # Optimal number of bits and hash functions for the capacity/error rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    # Adds a 16 byte digest, returning True if it was (probably) already present
+    def add(self, digest):
+        (h1, h2) = split_digest(digest)
+        present = True
+        for i in range(0, self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            mask = 1 << (bit & 7)
+            if not self.bits[bit >> 3] & mask:
+                present = False
+                self.bits[bit >> 3] |= mask
+        return present
+
+
+class CountMinSketch:
+    def __init__(self, width=1 << 21, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counts = array("I", bytes(4 * width * depth))
+
+    def cells(self, digest):
+        (h1, h2) = split_digest(digest)
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(0, self.depth)]
+
+    # Counts a digest, returning its new estimated count (conservative update)
+    def add(self, digest):
+        cells = self.cells(digest)
+        estimate = min(self.counts[c] for c in cells) + 1
+        for c in cells:
+            if self.counts[c] < estimate:
+                self.counts[c] = min(estimate, 0xffffffff)
+        return estimate
+
+    def estimate(self, digest):
+        return min(self.counts[c] for c in self.cells(digest))
+
+
+# Deduplicates (source, target) sentence pairs across all language pairs of a
+# run in bounded memory. Bloom filter false positives drop a small fraction
+# (about error_rate) of unique pairs.
+class PairDeduplicator:
+    def __init__(self, capacity=10000000, error_rate=0.001, count=False, sketch_width=1 << 21,
+                 sketch_depth=4):
+        self.seen = BloomFilter(capacity, error_rate)
+        self.sketch = CountMinSketch(sketch_width, sketch_depth) if count else None
+        self.written = 0
+        self.dropped = 0
+
+    def digest(self, pair_code, source, target):
+        data = "\0".join((pair_code, source, target)).encode("utf-8")
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    # Returns True if the pair should be written (it was not seen before)
+    def check(self, pair_code, source, target):
+        digest = self.digest(pair_code, source, target)
+        if self.sketch is not None:
+            self.sketch.add(digest)
+        if self.seen.add(digest):
+            self.dropped += 1
+            return False
+        self.written += 1
+        return True
+
+    # Writes the estimated total count of every line of a bitext file to a
+    # sidecar file (one count per line, in the same order)
+    def write_frequencies(self, pair_code, bi_path, freq_path, b64=False):
+        if self.sketch is None:
+            raise Exception("Pair counts were not kept")
+        with open(bi_path, encoding="utf-8", newline="\n") as bi_in, open(freq_path, mode="w", encoding="utf-8") as freq_out:
+            for line in bi_in:
+                fields = line.rstrip("\n").split("\t")
+                (source, target) = (fields[1], fields[3])
+                if b64:
+                    source = base64.b64decode(source).decode("utf-8")
+                    target = base64.b64decode(target).decode("utf-8")
+                digest = self.digest(pair_code, source, target)
+                print(self.sketch.estimate(digest), file=freq_out)
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+# output.py
+#
+# Writes the results of strand-align: for every language pair a bitext file
+# (<prefix>.<pair>) with one aligned segment per line, an annotation file
+# (<prefix>.<pair>.ann) with one line per document pair, and optionally a
+# random access index (<prefix>.<pair>.idx). Files are opened the first time a
+# pair is seen. StreamWriter writes the same data as a single stream of
+# records instead (for use in pipelines).
+
+import codecs
+
+from strand.bitext_index import BitextIndexWriter
+from strand.pipeline import format_ann, format_bi
+from strand.stats import RunStats
+
+
+class BitextWriter:
+    def __init__(self, out_prefix, index=False, deduplicator=None, output_base64=False, stats=None):
+        self.out_prefix = out_prefix
+        self.index = index
+        self.deduplicator = deduplicator
+        self.output_base64 = output_base64
+        self.stats = stats if stats is not None else RunStats()
+        # Output files and the number of bitext lines written, per pair
+        self.output_files = {}
+        self.line_counters = {}
+
+    def bitext_path(self, pair_code):
+        return "%s.%s" % (self.out_prefix, pair_code)
+
+    def pair_files(self, pair_code):
+        if pair_code not in self.output_files:
+            pair_files = {}
+            pair_files["bi"] = codecs.open(self.bitext_path(pair_code), encoding="utf-8", mode="w")
+            pair_files["ann"] = codecs.open("%s.ann" % self.bitext_path(pair_code),
+                                            encoding="utf-8", mode="w")
+            if self.index:
+                pair_files["index"] = BitextIndexWriter("%s.idx" % self.bitext_path(pair_code))
+            self.output_files[pair_code] = pair_files
+            self.line_counters[pair_code] = 0
+        return self.output_files[pair_code]
+
+    # Writes the aligned segments of a document pair as they are produced,
+    # then the annotation if we had any data. Returns the number of segments
+    # written.
+    def write(self, result):
+        pair_code = result.pair_code
+        pair_files = self.pair_files(pair_code)
+        bi_out = pair_files["bi"]
+        bi_start = bi_out.tell()
+        increment = 0
+        for b in result.segments:
+            with self.stats.timer("output"):
+                if self.deduplicator and not self.deduplicator.check(pair_code, b[1], b[3]):
+                    self.stats.incr("dedup_dropped")
+                    continue
+                print(format_bi(b, self.output_base64), file=bi_out)
+            increment += 1
+
+        if increment > 0:
+            current_offset = self.line_counters[pair_code]
+
+            ann_out = pair_files["ann"]
+            ann_start = ann_out.tell()
+            print(format_ann(result, current_offset, increment), file=ann_out)
+            if self.index:
+                pair_files["index"].add(result.source_url, result.target_url,
+                                        bi_start, bi_out.tell() - bi_start,
+                                        ann_start, ann_out.tell() - ann_start,
+                                        increment, current_offset)
+
+            self.line_counters[pair_code] += increment
+            self.stats.incr("alignments", increment)
+        return increment
+
+    # Closes every file, writing the pair frequency sidecars (<prefix>.<pair>.freq)
+    # if the deduplicator kept counts
+    def close(self, write_frequencies=False):
+        for pair in self.output_files:
+            self.output_files[pair]["bi"].close()
+            self.output_files[pair]["ann"].close()
+            if "index" in self.output_files[pair]:
+                self.output_files[pair]["index"].close()
+            if write_frequencies and self.deduplicator:
+                self.deduplicator.write_frequencies(pair, self.bitext_path(pair),
+                                                    "%s.freq" % self.bitext_path(pair),
+                                                    self.output_base64)
+
+
+# Writes the results of every language pair to a single text stream, one
+# record per line, each with a record type and the pair code:
+#   B<TAB><pair><TAB><bitext line>
+#   A<TAB><pair><TAB><annotation line>
+# The B records of a document pair come first, followed by its A record, so
+# the annotation offsets count the B records of the pair seen so far. The
+# stream is flushed after every document pair; writes block while the reader
+# is behind.
+class StreamWriter:
+    def __init__(self, out, deduplicator=None, output_base64=False, stats=None):
+        self.out = out
+        self.deduplicator = deduplicator
+        self.output_base64 = output_base64
+        self.stats = stats if stats is not None else RunStats()
+        self.line_counters = {}
+
+    def write(self, result):
+        pair_code = result.pair_code
+        increment = 0
+        for b in result.segments:
+            with self.stats.timer("output"):
+                if self.deduplicator and not self.deduplicator.check(pair_code, b[1], b[3]):
+                    self.stats.incr("dedup_dropped")
+                    continue
+                self.out.write("B\t%s\t%s\n" % (pair_code, format_bi(b, self.output_base64)))
+            increment += 1
+
+        if increment > 0:
+            current_offset = self.line_counters.get(pair_code, 0)
+            with self.stats.timer("output"):
+                self.out.write("A\t%s\t%s\n" % (pair_code, format_ann(result, current_offset, increment)))
+                self.out.flush()
+            self.line_counters[pair_code] = current_offset + increment
+            self.stats.incr("alignments", increment)
+        return increment
+
+    def close(self, write_frequencies=False):
+        self.out.flush()
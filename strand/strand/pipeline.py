@@ -0,0 +1,465 @@
+#!/usr/bin/python
+
+# pipeline.py
+#
+# The per-entry alignment pipeline shared by strand-align and the alignment
+# server: parse each webpage of an entry with StrandTarget, align every
+# language version against English with STRAND, and extract (optionally
+# sentence aligned) parallel segments.
+
+import base64
+import multiprocessing
+
+from functools import partial
+from io import StringIO
+
+# Used for parsing HTML
+import bs4
+from lxml import etree
+
+from strand import parsers
+from strand import strand
+from strand.segmenter import Segmenter
+from strand.stats import RunStats
+
+from py_aligner import PyGaleChurchAligner
+
+
+# The result of aligning one document pair. segments is an iterator over
+# (source index, source text, target index, target text, cost) tuples.
+class PairResult:
+    def __init__(self, source_lang, target_lang, source_url, target_url, segments, dp,
+                 source_len, target_len):
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.pair_code = "%s-%s" % (source_lang, target_lang)
+        self.source_url = source_url
+        self.target_url = target_url
+        self.segments = segments
+        self.dp = dp
+        self.source_len = source_len
+        self.target_len = target_len
+
+
+# Holds the objects which are expensive to construct (aligners, segmenters)
+# so that they can be reused across entries.
+#
+# The mode selects how document pairs are aligned: "strand" runs the STRAND
+# tag/chunk DP, "plaintext" extracts the text of both pages with
+# PlaintextTarget and runs a banded Gale-Church over the sentences of the
+# whole documents, and "auto" falls back from STRAND to plaintext when the
+# STRAND difference percentage is above plaintext_threshold (structurally
+# different pages of parallel documents).
+class Pipeline:
+    MODES = ("strand", "plaintext", "auto")
+
+    def __init__(self, sentence_aligner=None, align_href=False, stats=None, anchored=False,
+                 anchor_check=False, dp_cache=0, mode="strand", plaintext_threshold=0.5, gc_band=50,
+                 languages=None, anchor_workers=0):
+        if mode not in self.MODES:
+            raise Exception("Invalid alignment mode: %s" % mode)
+        if sentence_aligner == "GC":
+            self.sent_aligner = PyGaleChurchAligner()
+        else:
+            self.sent_aligner = None
+        self.align_href = align_href
+        self.stats = stats if stats is not None else RunStats()
+        # With anchor_workers, the gaps between anchors are aligned in a pool
+        # of processes (most gaps are tiny, so they are sent in chunks)
+        self.gap_pool = None
+        gap_map = map
+        if anchored and anchor_workers > 1:
+            self.gap_pool = multiprocessing.get_context("fork").Pool(anchor_workers)
+            gap_map = partial(self.gap_pool.imap, chunksize=16)
+        self.strand_aligner = strand.StrandAligner(anchored=anchored, anchor_check=anchor_check,
+                                                   gap_map=gap_map, stats=self.stats,
+                                                   cache_size=dp_cache)
+        self.mode = mode
+        self.plaintext_threshold = plaintext_threshold
+        self.gc_band = gc_band
+        # The source languages to align against English (None for all of them)
+        self.languages = languages
+        self.plaintext_aligner = None
+        if mode != "strand":
+            self.plaintext_aligner = self.sent_aligner or PyGaleChurchAligner()
+        # One segmenter per language, we will always be working with English
+        self.segmenters = {"en": Segmenter("en")}
+
+    # Replaces the stats the pipeline reports to (the worker processes collect
+    # the stats of every entry separately)
+    def use_stats(self, stats):
+        self.stats = stats
+        self.strand_aligner.stats = stats
+
+    def close(self):
+        if self.gap_pool is not None:
+            self.gap_pool.close()
+            self.gap_pool.join()
+            self.gap_pool = None
+
+    def segmenter(self, lang):
+        if lang not in self.segmenters:
+            self.segmenters[lang] = Segmenter(lang)
+        return self.segmenters[lang]
+
+    # The languages of the webpages of an entry which take part in a pair:
+    # the requested source languages and the target language, if present
+    def wanted_languages(self, webpages, target_lang="en"):
+        languages = set(webpage['language'] for webpage in webpages)
+        if target_lang not in languages:
+            return set()
+        if self.languages is not None:
+            languages = set(lang for lang in languages if lang in self.languages)
+            if len(languages) == 0:
+                return set()
+            languages.add(target_lang)
+        return languages
+
+    # Parses every webpage of an entry which takes part in a pair, returning a
+    # dict from language to a dict holding the "url", the "html" and, if
+    # parsing succeeded, the "strand" output (not computed in plaintext mode).
+    # The HTML of the other webpages is never decoded.
+    def parse_pages(self, webpages, entry_num=-1):
+        data_by_language = {}
+        wanted = self.wanted_languages(webpages)
+        for webpage in webpages:
+            if webpage['language'] not in wanted:
+                self.stats.incr("skipped_pages")
+                continue
+            if webpage['language'] not in data_by_language:
+                data_by_language[webpage['language']] = {}
+            lang = webpage['language']
+            data_by_language[lang]["url"] = webpage['url']
+            data_by_language[lang]["html"] = webpage['html']
+            if self.mode == "plaintext":
+                continue
+            try:
+                # Initialize the HTML parser
+                with self.stats.timer("parse"):
+                    strand_parser = etree.HTMLParser(encoding="utf-8",
+                                                     target=parsers.StrandTarget(webpage['language'], self.align_href))
+                    tagchunks = apply_parser(webpage['html'], strand_parser, self.stats)
+                data_by_language[lang]["strand"] = tagchunks
+            except MemoryError:
+                raise
+            except:
+                print("Error parsing %s HTML at line %d" % (lang, entry_num))
+                self.stats.incr("parse_errors")
+        return data_by_language
+
+    # Aligns every other language version against the target language,
+    # yielding one PairResult per document pair. The target page is converted
+    # to tagchunks and encoded only once for all of the pairs. The segments of
+    # each result are produced lazily and should be consumed before moving to
+    # the next.
+    def align_pages(self, data_by_language, target_lang="en"):
+        if target_lang not in data_by_language:
+            return
+        if self.mode != "plaintext":
+            if "strand" not in data_by_language[target_lang]:
+                return
+            with self.stats.timer("strand"):
+                target_tagchunks = self.strand_aligner.create_tag_chunk_stream(
+                    data_by_language[target_lang]["strand"].split("\n"))
+                pivot = self.strand_aligner.encode_pivot(target_tagchunks)
+        for source_lang in data_by_language:
+            if source_lang == target_lang:
+                continue
+            if self.mode == "plaintext":
+                self.stats.incr("pairs")
+                yield self.align_plaintext(data_by_language, source_lang, target_lang)
+                continue
+            if "strand" not in data_by_language[source_lang]:
+                continue
+            self.stats.incr("pairs")
+            with self.stats.timer("strand"):
+                source_tagchunks = self.strand_aligner.create_tag_chunk_stream(
+                    data_by_language[source_lang]["strand"].split("\n"))
+                grid_size = len(source_tagchunks) * len(target_tagchunks)
+                if grid_size > 1000000000:
+                    self.stats.incr("strand_grid_skipped")
+                    (segments, dp, source_len, target_len) = (iter([]), 1.0, 0, 0)
+                else:
+                    alignment, dp = self.strand_aligner.align_with_pivot(source_tagchunks, pivot)
+                    segments = iter_segments(alignment, self.sent_aligner, self.segmenter(source_lang),
+                                             self.segmenter(target_lang), self.stats)
+                    (source_len, target_len) = (len(source_tagchunks), len(target_tagchunks))
+            if self.mode == "auto" and dp > self.plaintext_threshold:
+                self.stats.incr("plaintext_fallback")
+                yield self.align_plaintext(data_by_language, source_lang, target_lang)
+                continue
+            yield PairResult(source_lang, target_lang,
+                             data_by_language[source_lang]["url"], data_by_language[target_lang]["url"],
+                             segments, dp, source_len, target_len)
+
+    # Extracts the text of a page with PlaintextTarget and splits it into
+    # sentences. The sentences are kept in the page dict, so that the target
+    # page is only processed once per entry. Returns None if the page could
+    # not be parsed.
+    def plaintext_sentences(self, page, lang):
+        if "sentences" not in page:
+            try:
+                with self.stats.timer("plaintext"):
+                    parser = etree.HTMLParser(encoding="utf-8", target=parsers.PlaintextTarget())
+                    text = apply_parser(page["html"], parser, self.stats)
+            except MemoryError:
+                raise
+            except:
+                print("Error extracting %s text of %s" % (lang, page["url"]))
+                self.stats.incr("plaintext_errors")
+                page["sentences"] = None
+                return None
+            with self.stats.timer("segment"):
+                segmenter = self.segmenter(lang)
+                page["sentences"] = [sent for line in text.split("\n") if line.strip()
+                                     for sent in segmenter.process(line)]
+        return page["sentences"]
+
+    # Aligns the sentences of two whole documents with a banded Gale-Church.
+    # The segments are (bead index, source text, bead index, target text,
+    # 0.0) tuples, the difference percentage is the fraction of beads
+    # aligning a sentence to nothing (1-0 or 0-1), and the lengths are
+    # numbers of sentences.
+    def align_plaintext(self, data_by_language, source_lang, target_lang):
+        source = data_by_language[source_lang]
+        target = data_by_language[target_lang]
+        source_sents = self.plaintext_sentences(source, source_lang)
+        target_sents = self.plaintext_sentences(target, target_lang)
+        if source_sents is None or target_sents is None:
+            return PairResult(source_lang, target_lang, source["url"], target["url"], iter([]), 1.0, 0, 0)
+        width = len(target_sents) + 1
+        if self.gc_band > 0 and len(source_sents) > 0:
+            # The band is widened by the slope of the diagonal
+            slope = -(-len(target_sents) // len(source_sents))
+            width = min(width, 2 * (self.gc_band + max(0, slope - 1)) + 2)
+        grid_size = (len(source_sents) + 1) * width
+        if grid_size > 1000000000:
+            self.stats.incr("gc_grid_skipped")
+            return PairResult(source_lang, target_lang, source["url"], target["url"], iter([]), 1.0, 0, 0)
+        self.stats.incr("gc_cells", grid_size)
+        with self.stats.timer("gale_church"):
+            (_, aligned_source, aligned_target) = self.plaintext_aligner.align(
+                source_sents, target_sents, self.gc_band)
+        unaligned = sum(1 for (s_sent, t_sent) in zip(aligned_source, aligned_target)
+                        if len(s_sent) == 0 or len(t_sent) == 0)
+        dp = unaligned / len(aligned_source) if len(aligned_source) > 0 else 1.0
+        # Gale-Church only gives the cost of the whole document, which is not
+        # on the scale of the per segment STRAND costs
+        segments = [(i, s_sent, i, t_sent, 0.0)
+                    for (i, (s_sent, t_sent)) in enumerate(zip(aligned_source, aligned_target))
+                    if s_sent != t_sent]
+        return PairResult(source_lang, target_lang, source["url"], target["url"], iter(segments), dp,
+                          len(source_sents), len(target_sents))
+
+    def align_entry(self, webpages, entry_num=-1):
+        return self.align_pages(self.parse_pages(webpages, entry_num))
+
+    # Aligns an entry and materializes the segments of every result, so that
+    # the results can be sent to another process
+    def align_entry_list(self, webpages, entry_num=-1):
+        results = []
+        for result in self.align_entry(webpages, entry_num):
+            result.segments = list(result.segments)
+            results.append(result)
+        return results
+
+
+# The pipeline of the current worker process (of the server or of the
+# scheduler), built once per process by init_worker
+_worker_pipeline = None
+
+
+# Initializer of pool worker processes. options are the keyword arguments of
+# the Pipeline.
+def init_worker(options):
+    global _worker_pipeline
+    _worker_pipeline = Pipeline(**options)
+
+
+def worker_pipeline():
+    return _worker_pipeline
+
+# Formats one aligned segment as a line of the bitext output (without the
+# trailing newline)
+
+
+def format_bi(b, output_base64=False):
+    src_text = b[1]
+    tgt_text = b[3]
+    if output_base64:
+        src_text = base64.b64encode(src_text.encode("utf8")).decode("utf8")
+        tgt_text = base64.b64encode(tgt_text.encode("utf8")).decode("utf8")
+    return "{:d}\t{:s}\t{:d}\t{:s}\t{:f}".format(b[0], src_text, b[2], tgt_text, b[4])
+
+# Formats the .ann line of a document pair (without the trailing newline)
+
+
+def format_ann(result, offset, count):
+    return "{:s}\t{:s}\t{:d}\t{:d}\t{:f}\t{:d}\t{:d}".format(result.source_url,
+                                                            result.target_url,
+                                                            offset,
+                                                            count,
+                                                            result.dp,
+                                                            result.source_len,
+                                                            result.target_len)
+
+# Walks a STRAND alignment, accumulating aligned chunk text until the next
+# aligned pair of tags, and yields the resulting segments (sentence aligned
+# with the sentence aligner, if any).
+
+
+def iter_segments(alignment, sent_aligner, source_seg, target_seg, stats):
+    current_source_chunk = StringIO()
+    current_target_chunk = StringIO()
+    for (si, s, ti, t, c) in alignment:
+        if (s and s.tc_type == strand.TCType.CHUNK
+                and t and t.tc_type == strand.TCType.CHUNK):
+            current_source_chunk.write(s.chunk_data)
+            current_target_chunk.write(t.chunk_data)
+        elif (s and s.tc_type != strand.TCType.CHUNK and
+              t and t.tc_type != strand.TCType.CHUNK and
+              current_source_chunk.tell() > 0 and current_target_chunk.tell() > 0):
+
+            if s.tag == t.tag == "a" and s.tc_type == t.tc_type != strand.TCType.CHUNK:
+                continue
+
+            source_chunk_data = current_source_chunk.getvalue()
+            target_chunk_data = current_target_chunk.getvalue()
+            current_source_chunk = StringIO()
+            current_target_chunk = StringIO()
+
+            if sent_aligner is None:
+                yield (si, source_chunk_data, ti, target_chunk_data, c)
+            else:
+                with stats.timer("segment"):
+                    source_sents = source_seg.process(source_chunk_data)
+                    target_sents = target_seg.process(target_chunk_data)
+                # print("GC alignment: %d x %d = %d" % (len(source_sents), len(
+                #     target_sents), len(source_sents) * len(target_sents)))
+                grid_size = len(source_sents) * len(target_sents)
+                if grid_size > 1000000000:
+                    stats.incr("gc_grid_skipped")
+                    continue
+                stats.incr("gc_cells", grid_size)
+                with stats.timer("gale_church"):
+                    (cost, aligned_source, aligned_target) = sent_aligner.align(
+                        source_sents, target_sents)
+                for i in range(0, len(aligned_source)):
+                    s_sent = aligned_source[i]
+                    t_sent = aligned_target[i]
+                    # if s_sent != t_sent and alpha_min_length(s_sent, t_sent) >= 5 and end_punc(s_sent, t_sent) == 1:
+                    if s_sent != t_sent:
+                        yield (si, s_sent, ti, t_sent, c)
+
+# Usese BeautifulSoup to handle encodings (taken from lxml tutorial)
+
+
+def decode_html(html_string):
+    converted = bs4.UnicodeDammit(html_string, isHTML=True)
+    if not converted.unicode_markup:
+        raise UnicodeDecodeError(
+            "Failed to detect encoding, tried [%s]",
+            ', '.join(converted.tried_encodings))
+    return converted.unicode_markup
+
+# Passes the HTML through the given parser. Uses the BeautifulSoup parser as a
+# failsafe.
+
+
+def apply_parser(html, parser, stats=None):
+    result = ""
+    try:
+        result = etree.parse(StringIO(html), parser)
+    except MemoryError:
+        raise
+    except:  # TODO: find the specific error
+        try:
+            result = etree.parse(StringIO(decode_html(html)), parser)
+            if stats:
+                stats.incr("parser_decode_fallback")
+        except:
+            soup = bs4.BeautifulSoup(html, "lxml")
+            result = etree.parse(StringIO(str(soup)), parser)
+            if stats:
+                stats.incr("parser_bs4_fallback")
+
+    return result
+
+# Parses a line of the tab-separated values file. Returns the key (a language
+# independent URL) and a list of webpages (dicts with a url, language, and
+# html, which is only decoded when it is first accessed). Returns an empty key
+# on failure.
+# The format is: key, (language, url, webpage){2,}
+# The HTML will have both tabs and newlines escaped
+
+
+def parse_entry(line, b64=False):
+    fields = line.split("\t")
+    if len(fields) < 4 or ((len(fields) - 1) % 3) != 0:
+        print("\n", len(fields))
+        for field in fields:
+            trunc = field
+            if len(trunc) > 50:
+                trunc = field[0:50]
+            print("\t", trunc)
+        return ("", {})
+
+    key = fields[0]
+    offset = 1
+    webpages = []
+    while offset + 2 < len(fields):
+        webpages.append(LazyWebpage(fields[offset], fields[offset+1], fields[offset+2], b64))
+        offset += 3
+
+    return (key, webpages)
+
+# A webpage dict whose 'html' is decoded from the raw field of the entry on
+# first access
+
+
+class LazyWebpage(dict):
+    def __init__(self, language, url, html_field, b64=False):
+        super(LazyWebpage, self).__init__(language=language, url=url)
+        self.html_field = html_field
+        self.b64 = b64
+
+    def __missing__(self, key):
+        if key != 'html':
+            raise KeyError(key)
+        html = decode_html_field(self.html_field, self.b64)
+        self['html'] = html
+        self.html_field = None
+        return html
+
+# Parses a --pairs option (comma separated pair codes such as "ja-en,fr-en")
+# into the set of source languages. Every pair must have the target language
+# as its target.
+
+
+def parse_pairs(pairs, target_lang="en"):
+    languages = set()
+    for pair in pairs.split(","):
+        pair = pair.strip()
+        if len(pair) == 0:
+            continue
+        (source_lang, _, pair_target) = pair.partition("-")
+        if len(source_lang) == 0 or pair_target != target_lang:
+            raise Exception("Invalid language pair %s (expected <lang>-%s)" % (pair, target_lang))
+        languages.add(source_lang)
+    return languages
+
+# Decodes the (escaped or base64 encoded) HTML field of an entry
+
+
+def decode_html_field(field, b64=False):
+    if b64:
+        html = base64.b64decode(field).decode("utf-8").replace("\t", " ")
+    else:
+        html = field
+    return unescape_tabs_and_newlines(html)
+
+# Reverses the unescaping of newlines and tabs needed to store the HTML files
+
+
+def unescape_tabs_and_newlines(str):
+    return str.replace("\\t", "\t").replace("\\n", "\n")
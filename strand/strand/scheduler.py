@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+# scheduler.py
+#
+# Parallel batch alignment for strand-align. The cost of an entry grows with
+# the product of the sizes of its pages and the English page, and ranges over
+# orders of magnitude, so splitting the input evenly leaves workers idle while
+# one of them aligns a few giant pages. Instead, the input is read ahead in
+# windows, the cost of every entry is estimated from the sizes of its raw HTML
+# fields, and the entries of a window are dispatched to a pool of workers
+# largest first (longest processing time first). The results are handed back
+# in input order, so the output (and its offsets) does not depend on the
+# number of workers.
+
+import itertools
+import multiprocessing
+import time
+
+from strand.pipeline import init_worker, parse_entry, worker_pipeline
+from strand.stats import RunStats
+
+
+# Estimates the cost of aligning an entry (a raw input line) without decoding
+# it: the sizes of the HTML fields of every page times the size of the English
+# page (the STRAND DP), plus the total size (parsing). Only the pages in
+# languages (a set of encoded source languages) are counted, if given.
+def entry_cost(line, target_lang=b"en", languages=None):
+    fields = line.split(b"\t")
+    sizes = []
+    target_size = 0
+    for (lang, field) in zip(fields[1::3], fields[3::3]):
+        if lang == target_lang:
+            target_size = len(field)
+        elif languages is None or lang in languages:
+            sizes.append(len(field))
+    if target_size == 0:
+        return 0
+    return target_size * sum(sizes) + target_size + sum(sizes)
+
+
+# Decodes and aligns one entry in a worker process. Returns the entry number,
+# key, number of pages, list of results, stats, and the wall and CPU time of
+# the entry.
+def align_job(job):
+    (entry_num, line, b64) = job
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    stats = RunStats()
+    pipeline = worker_pipeline()
+    pipeline.use_stats(stats)
+    with stats.timer("decode"):
+        (key, webpages) = parse_entry(line.decode("utf8"), b64=b64)
+    results = []
+    if len(key) > 0:
+        results = pipeline.align_entry_list(webpages, entry_num)
+    return (entry_num, key, len(webpages), results, stats, time.perf_counter() - start,
+            time.process_time() - cpu_start)
+
+
+class ParallelAligner:
+    # options are the keyword arguments of the Pipeline. Up to two windows of
+    # read_ahead entries are in flight at once.
+    def __init__(self, options, workers=2, read_ahead=256, b64=False, stats=None):
+        self.options = options
+        self.workers = workers
+        self.read_ahead = max(1, read_ahead)
+        self.b64 = b64
+        self.languages = None
+        if options.get("languages") is not None:
+            self.languages = set(lang.encode("utf-8") for lang in options["languages"])
+        self.stats = stats if stats is not None else RunStats()
+        self.pool = None
+        # CPU time spent aligning in the workers, and wall time of the parallel
+        # runs
+        self.busy = 0.0
+        self.elapsed = 0.0
+
+    def start(self):
+        self.pool = multiprocessing.get_context("fork").Pool(
+            self.workers, initializer=init_worker, initargs=(self.options,))
+
+    # Aligns the entries of the given input lines (numbered from first_entry
+    # on). Yields (entry number, line length, key, number of pages, results,
+    # seconds) in input order. The stats of every entry are merged into the
+    # stats of the aligner.
+    def align_lines(self, lines, first_entry=0):
+        if self.pool is None:
+            self.start()
+        start = time.perf_counter()
+        lines = iter(lines)
+        pending = {}
+        entry_num = first_entry
+        next_entry = first_entry
+        exhausted = False
+        try:
+            while True:
+                if not exhausted and len(pending) <= self.read_ahead:
+                    window = []
+                    for line in itertools.islice(lines, self.read_ahead):
+                        window.append((entry_cost(line, languages=self.languages), entry_num, line))
+                        entry_num += 1
+                    exhausted = len(window) < self.read_ahead
+                    # Longest processing time first (ties in input order)
+                    window.sort(key=lambda item: (-item[0], item[1]))
+                    for (_, num, line) in window:
+                        pending[num] = (len(line), self.pool.apply_async(align_job, ((num, line, self.b64),)))
+                    continue
+                if next_entry not in pending:
+                    break
+                (line_length, async_result) = pending.pop(next_entry)
+                (num, key, num_pages, results, entry_stats, seconds, cpu_seconds) = async_result.get()
+                self.busy += cpu_seconds
+                self.stats.merge(entry_stats)
+                yield (num, line_length, key, num_pages, results, seconds)
+                next_entry += 1
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    # Fraction of the available worker time spent aligning (CPU time, so that
+    # workers waiting for a CPU do not count as busy)
+    def utilization(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.busy / (self.workers * self.elapsed)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,296 @@
+#!/usr/bin/python
+
+# server.py
+#
+# A long-lived alignment server. The aligners and segmenters are built once
+# per worker process and kept warm, and concurrent requests are gathered into
+# batches which are dispatched to a pool of workers.
+#
+# Requests are JSON documents POSTed to /align. A request holds the pages of
+# one entry (every non-English page is aligned against the English one):
+#   {"pages": [{"language": "en", "url": ..., "html": ...},
+#              {"language": "ja", "url": ..., "html": ...}]}
+# A JSON list of requests is a batch, answered with a list of responses. Each
+# response lists the aligned document pairs with their alignments (in the
+# bitext column order) and .ann line (with an offset of 0).
+
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from strand.pipeline import format_ann, init_worker, worker_pipeline
+
+
+# Aligns the pages of a single request in the current process
+def align_request(request):
+    try:
+        pages = request["pages"]
+        for page in pages:
+            for field in ("language", "url", "html"):
+                if field not in page:
+                    raise Exception("Page is missing the %s field" % field)
+        pairs = []
+        for result in worker_pipeline().align_entry(pages):
+            alignments = [list(b) for b in result.segments]
+            pairs.append({"pair": result.pair_code,
+                          "source_url": result.source_url,
+                          "target_url": result.target_url,
+                          "alignments": alignments,
+                          "difference": result.dp,
+                          "source_length": result.source_len,
+                          "target_length": result.target_len,
+                          "ann": format_ann(result, 0, len(alignments))})
+        return {"pairs": pairs}
+    except Exception as e:
+        return {"error": "%s: %s" % (type(e).__name__, e)}
+
+
+def align_batch(requests):
+    return [align_request(request) for request in requests]
+
+
+# Collects requests from the handler threads and dispatches them in batches
+# of up to batch_size, waiting at most batch_wait seconds to fill a batch.
+class Batcher:
+    def __init__(self, options, workers=1, batch_size=16, batch_wait=0.005):
+        self.workers = workers
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.options = options
+        self.pool = None
+        if workers > 0:
+            self.start_pool()
+        else:
+            init_worker(options)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "batches": 0, "pairs": 0, "errors": 0}
+        self.total_latency = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # A worker which dies (e.g. killed by the OS) breaks the whole pool: the
+    # requests it was running fail, and a new pool is started for the next
+    # batch
+    def start_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"),
+                                        initializer=init_worker, initargs=(self.options,))
+
+    # Queues a request, returning a Future for its response
+    def submit(self, request):
+        future = Future()
+        self.queue.put((request, future, time.perf_counter()))
+        return future
+
+    def run(self):
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self.dispatch(batch)
+
+    def dispatch(self, batch):
+        requests = [request for (request, _, _) in batch]
+        with self.lock:
+            self.counters["batches"] += 1
+        if self.pool is None:
+            self.finish(batch, align_batch(requests))
+        else:
+            # One chunk per worker so that a batch costs one round trip each
+            chunksize = max(1, -(-len(requests) // self.workers))
+            for start in range(0, len(batch), chunksize):
+                chunk = batch[start:start + chunksize]
+                try:
+                    future = self.pool.submit(align_batch, requests[start:start + chunksize])
+                except BrokenProcessPool:
+                    self.start_pool()
+                    future = self.pool.submit(align_batch, requests[start:start + chunksize])
+                future.add_done_callback(lambda future, chunk=chunk: self.done(chunk, future))
+
+    def done(self, batch, future):
+        error = future.exception()
+        if error is not None:
+            self.fail(batch, error)
+        else:
+            self.finish(batch, future.result())
+
+    def finish(self, batch, responses):
+        now = time.perf_counter()
+        with self.lock:
+            for ((_, _, start), response) in zip(batch, responses):
+                self.counters["requests"] += 1
+                self.counters["pairs"] += len(response.get("pairs", []))
+                if "error" in response:
+                    self.counters["errors"] += 1
+                self.total_latency += now - start
+        for ((_, future, _), response) in zip(batch, responses):
+            future.set_result(response)
+
+    def fail(self, batch, error):
+        with self.lock:
+            self.counters["errors"] += len(batch)
+        for (_, future, _) in batch:
+            future.set_exception(error)
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters)
+            result["mean_latency"] = (self.total_latency / result["requests"]
+                                      if result["requests"] > 0 else 0.0)
+        result["queued"] = self.queue.qsize()
+        return result
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class AlignmentHandler(BaseHTTPRequestHandler):
+    # Keep connections open between requests (every response has a length)
+    protocol_version = "HTTP/1.1"
+
+    # Unix socket clients have no address
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self.send_json(200, self.server.batcher.stats())
+        else:
+            self.send_json(404, {"error": "Unknown path: %s" % self.path})
+
+    def do_POST(self):
+        if self.path != "/align":
+            self.send_json(404, {"error": "Unknown path: %s" % self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError as e:
+            self.send_json(400, {"error": "Invalid request: %s" % e})
+            return
+        batcher = self.server.batcher
+        if not isinstance(data, (list, dict)):
+            self.send_json(400, {"error": "Expected a JSON object or list"})
+            return
+        try:
+            if isinstance(data, list):
+                futures = [batcher.submit(request) for request in data]
+                response = [future.result() for future in futures]
+            else:
+                response = batcher.submit(data).result()
+        except Exception as e:
+            # The worker aligning the request died
+            self.send_json(500, {"error": "%s: %s" % (type(e).__name__, e)})
+            return
+        self.send_json(200, response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Creates a server for an address of the form HOST:PORT, :PORT or unix:PATH
+def make_server(address, batcher):
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = ThreadingUnixHTTPServer(path, AlignmentHandler)
+    else:
+        (host, _, port) = address.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), AlignmentHandler)
+        server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+def serve_forever(address, options, workers=1, batch_size=16, batch_wait=0.005):
+    batcher = Batcher(options, workers, batch_size, batch_wait)
+    server = make_server(address, batcher)
+    print("Serving alignments on %s" % address, file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if address.startswith("unix:") and os.path.exists(address[len("unix:"):]):
+            os.unlink(address[len("unix:"):])
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+# A minimal client for the server, keeping one connection open
+class AlignmentClient:
+    def __init__(self, address, timeout=None):
+        if address.startswith("unix:"):
+            self.conn = UnixHTTPConnection(address[len("unix:"):], timeout=timeout)
+        else:
+            (host, _, port) = address.rpartition(":")
+            self.conn = http.client.HTTPConnection(host or "127.0.0.1", int(port), timeout=timeout)
+
+    # Aligns one request (a dict with "pages") or a batch (a list of them)
+    def align(self, request):
+        body = json.dumps(request).encode("utf-8")
+        self.conn.request("POST", "/align", body, {"Content-Type": "application/json"})
+        response = self.conn.getresponse()
+        return json.loads(response.read().decode("utf-8"))
+
+    def close(self):
+        self.conn.close()
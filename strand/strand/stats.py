@@ -0,0 +1,180 @@
+#!/usr/bin/python
+
+# stats.py
+#
+# Run instrumentation for strand-align: cumulative wall time per pipeline
+# stage, event counters, the slowest entries seen so far, and optional
+# cProfile/tracemalloc dumps for a sample of entries.
+
+import cProfile
+import heapq
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+
+class RunStats:
+    def __init__(self, slowest_n=10):
+        self.start_time = time.perf_counter()
+        # Cumulative wall time (in seconds) spent in each stage
+        self.stage_times = {}
+        # Event counters (DP cells, parser fallbacks, skipped pairs, ...)
+        self.counters = {}
+        # Observed values (count, sum and max) of per-pair measurements
+        self.observations = {}
+        # Min-heap of (seconds, entry number, info) holding the slowest entries
+        self.slowest_n = slowest_n
+        self.slowest = []
+
+    # Accumulates the wall time of the enclosed block under the given stage
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+
+    # Wraps an iterator so that the time spent producing each item is charged
+    # to the given stage (used for reading the gzipped input)
+    def timed_iter(self, iterable, stage):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def incr(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def observe(self, name, value):
+        if name not in self.observations:
+            self.observations[name] = {"count": 0, "sum": 0.0, "max": value}
+        observation = self.observations[name]
+        observation["count"] += 1
+        observation["sum"] += value
+        observation["max"] = max(observation["max"], value)
+
+    # Adds the stage times, counters and observations of another RunStats
+    # (collected in a worker process) to these
+    def merge(self, other):
+        for (stage, seconds) in other.stage_times.items():
+            self.add_time(stage, seconds)
+        for (counter, amount) in other.counters.items():
+            self.incr(counter, amount)
+        for (name, observation) in other.observations.items():
+            if name not in self.observations:
+                self.observations[name] = dict(observation)
+            else:
+                mine = self.observations[name]
+                mine["count"] += observation["count"]
+                mine["sum"] += observation["sum"]
+                mine["max"] = max(mine["max"], observation["max"])
+
+    # Records the total time spent on one entry. info is a dict of sizes which
+    # is kept only if the entry is among the slowest seen so far.
+    def record_entry(self, entry_num, seconds, info):
+        item = (seconds, entry_num, info)
+        if len(self.slowest) < self.slowest_n:
+            heapq.heappush(self.slowest, item)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def to_dict(self):
+        slowest = []
+        for (seconds, entry_num, info) in sorted(self.slowest, reverse=True):
+            entry = {"entry": entry_num, "seconds": seconds}
+            entry.update(info)
+            slowest.append(entry)
+        observations = {}
+        for (name, observation) in self.observations.items():
+            observations[name] = dict(observation)
+            observations[name]["mean"] = observation["sum"] / observation["count"]
+        return {"elapsed": self.elapsed(),
+                "stage_times": self.stage_times,
+                "counters": self.counters,
+                "observations": observations,
+                "slowest_entries": slowest}
+
+    def write(self, path):
+        with open(path, mode="w", encoding="utf-8") as out:
+            json.dump(self.to_dict(), out, indent=2, sort_keys=True)
+            out.write("\n")
+
+    # A single line summary suitable for periodic progress reports
+    def progress_line(self):
+        elapsed = self.elapsed()
+        entries = self.counters.get("entries", 0)
+        rate = entries / elapsed if elapsed > 0 else 0.0
+        stages = " ".join("%s=%.1fs" % (stage, seconds) for (stage, seconds)
+                          in sorted(self.stage_times.items()))
+        return "[%.1fs] entries=%d (%.1f/s) pairs=%d dp_cells=%d %s" % (
+            elapsed, entries, rate, self.counters.get("pairs", 0),
+            self.counters.get("dp_cells", 0), stages)
+
+    def print_progress(self, file=sys.stderr):
+        print(self.progress_line(), file=file, flush=True)
+
+
+# Profiles a sample of entries with either cProfile or tracemalloc, writing one
+# dump per profiled entry to the given directory.
+class EntryProfiler:
+    MODES = ("cprofile", "tracemalloc")
+
+    def __init__(self, mode, out_dir, sample_every=100, top_n=50):
+        if mode not in self.MODES:
+            raise Exception("Invalid profiler mode: %s" % mode)
+        self.mode = mode
+        self.out_dir = out_dir
+        self.sample_every = max(1, sample_every)
+        self.top_n = top_n
+        os.makedirs(out_dir, exist_ok=True)
+
+    # Profiles the enclosed block if the entry number falls in the sample
+    @contextmanager
+    def profile(self, entry_num):
+        if entry_num % self.sample_every != 0:
+            yield
+            return
+        if self.mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(
+                    self.out_dir, "entry-%08d.prof" % entry_num))
+        else:
+            was_tracing = tracemalloc.is_tracing()
+            if not was_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            try:
+                yield
+            finally:
+                after = tracemalloc.take_snapshot()
+                (_, peak) = tracemalloc.get_traced_memory()
+                if not was_tracing:
+                    tracemalloc.stop()
+                path = os.path.join(self.out_dir, "entry-%08d.tracemalloc" % entry_num)
+                with open(path, mode="w", encoding="utf-8") as out:
+                    print("peak traced memory: %d bytes" % peak, file=out)
+                    for diff in after.compare_to(before, "lineno")[:self.top_n]:
+                        print(diff, file=out)
@@ -5,8 +5,13 @@
 # An implementation of the STRAND HTML aligner as described in
 # "The Web as a Parallel Corpus" (Resnik and Smith, 2003).
 
+import hashlib
 import re
 
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
 import py_aligner
 import py_maxent
 
@@ -14,7 +19,8 @@ from scipy.stats import stats
 
 
 class StrandAligner:
-    def __init__(self, difference_threshold=0.1, confidence_min=0.95):
+    def __init__(self, difference_threshold=0.1, confidence_min=0.95, anchored=False,
+                 anchor_check=False, gap_map=map, stats=None, cache_size=0):
         # Maximum value for the difference percentage
         self.difference_threshold = difference_threshold
         # Minimum value for the confidence of the correlation between chunk lengths
@@ -22,6 +28,21 @@ class StrandAligner:
         self.me_model = py_maxent.PyMaxent(1.0)
         self.tag_matcher = re.compile(r"^\[(START|END):([^\]]+)\]$", re.U)
         self.pa = py_aligner.PyAligner()
+        # Anchor-based alignment (see anchored_align). With anchor_check, the
+        # full DP is also run to measure how far the anchored result is from it.
+        self.anchored = anchored
+        self.anchor_check = anchor_check
+        # Used to align the gaps between anchors, e.g. the (i)map of a process
+        # pool (see Pipeline's anchor_workers)
+        self.gap_map = gap_map
+        # Optional RunStats receiving DP counters
+        self.stats = stats
+        # LRU cache of DP results keyed on the canonically relabeled sequences,
+        # so that pages sharing a template skeleton are only aligned once
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     # Returns an alignment and an instance set for the maxent model
     def create_instance_set(self, source_stream, target_stream):
@@ -82,6 +103,14 @@ class StrandAligner:
 
     # Align two tag/chunk streams
     def align(self, source_stream, target_stream):
+        (alignment, difference_percentage) = self.align_stream(source_stream, target_stream)
+        return list(alignment), difference_percentage
+
+    # Align two tag/chunk streams, returning a generator over the alignment
+    # positions instead of a list, along with the difference percentage. Each
+    # position is a (source index, source tagchunk, target index, target
+    # tagchunk, cost) tuple, with -1/None on the side of an insertion/deletion.
+    def align_stream(self, source_stream, target_stream):
         # (alignment, instance_set) = self.create_instance_set(
         #    source_stream, target_stream)
         # TODO: Classify
@@ -89,7 +118,7 @@ class StrandAligner:
         t_size = len(target_stream)
         if s_size == 0 or t_size == 0:
             print("One or more of the input streams are empty")
-            return []
+            return iter([]), 1.0
 
         # Compute the maximum deviation from the diagonal given the difference
         # percentage threshold
@@ -97,25 +126,134 @@ class StrandAligner:
 
         (source, target) = self.tc_to_int(source_stream, target_stream)
 
-        (alignment_cost, alignment) = self.pa.align(source, target)
+        (alignment_cost, alignment) = self.dp_align(source, target)
 
         # Compute the difference percentage: the total number of mismatched tokens
         # divided by the maximum possible number of mismatched tokens
         difference_percentage = abs(alignment_cost)
         difference_percentage /= max_difference
 
-        # Lengths of aligned source and target chunks, used in computing Pearson's
-        # coefficient
+        return self.iter_alignment(alignment, source_stream, target_stream), difference_percentage
+
+    # Encodes a pivot tag/chunk stream (usually the English page) once, so that
+    # it can be aligned against several other language versions
+    def encode_pivot(self, pivot_stream):
+        return PivotStream(pivot_stream, self)
+
+    # Aligns a source stream against an encoded pivot stream. Same return value
+    # as align_stream.
+    def align_with_pivot(self, source_stream, pivot):
+        s_size = len(source_stream)
+        t_size = len(pivot.stream)
+        if s_size == 0 or t_size == 0:
+            print("One or more of the input streams are empty")
+            return iter([]), 1.0
+
+        max_difference = s_size + t_size
+        source = self.encode_stream(source_stream, pivot.tag_to_int)
+
+        (alignment_cost, alignment) = self.dp_align(source, pivot.encoded)
+
+        difference_percentage = abs(alignment_cost)
+        difference_percentage /= max_difference
+
+        return self.iter_alignment(alignment, source_stream, pivot.stream), difference_percentage
+
+    # Aligns each of the source streams against a single pivot (target) stream,
+    # which is only encoded once. Returns a list of (alignment, difference
+    # percentage) tuples in the order of the source streams.
+    def align_pivot(self, pivot_stream, source_streams):
+        pivot = self.encode_pivot(pivot_stream)
         result = []
+        for source_stream in source_streams:
+            (alignment, difference_percentage) = self.align_with_pivot(source_stream, pivot)
+            result.append((list(alignment), difference_percentage))
+        return result
+
+    # Aligns two integer sequences, returning (cost, alignment) where the cost
+    # is minus the number of mismatched tokens and the alignment is a list of
+    # (source index, target index) pairs with -1 for insertions/deletions
+    def dp_align(self, source, target):
+        if self.cache_size <= 0:
+            return self.uncached_dp_align(source, target)
+        key = sequence_key(source, target)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            self.observe("dp_cache_hit", 1.0)
+            return self.cache[key]
+        self.cache_misses += 1
+        self.observe("dp_cache_hit", 0.0)
+        result = self.uncached_dp_align(source, target)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    # Returns (hits, misses, current size) of the DP cache
+    def cache_info(self):
+        return (self.cache_hits, self.cache_misses, len(self.cache))
+
+    def uncached_dp_align(self, source, target):
+        if not self.anchored:
+            self.count("dp_cells", len(source) * len(target))
+            return self.pa.align(source, target)
+        (cost, alignment) = self.anchored_align(source, target)
+        if self.anchor_check and self.stats is not None:
+            (full_cost, full_alignment) = self.pa.align(source, target)
+            self.stats.observe("anchor_difference_delta",
+                               float(full_cost - cost) / (len(source) + len(target)))
+            self.stats.observe("anchor_path_agreement", path_agreement(full_alignment, alignment))
+        return (cost, alignment)
+
+    # Divide and conquer alignment. Tokens which occur exactly once in each
+    # sequence (rare tags, or normalized links with --align-href) are matched as
+    # anchors, and the longest chain of anchors which is increasing in both
+    # sequences is kept, as in patience diff. The DP is then only run on the
+    # gaps between consecutive anchors, which are independent of each other and
+    # are aligned with self.gap_map. The result is not guaranteed to be optimal.
+    def anchored_align(self, source, target):
+        anchors = find_anchors(source, target)
+        self.count("anchored_pairs")
+        self.count("anchors", len(anchors))
+        gaps = []
+        (prev_s, prev_t) = (-1, -1)
+        for (s, t) in anchors + [(len(source), len(target))]:
+            gaps.append((prev_s + 1, prev_t + 1, source[prev_s + 1:s], target[prev_t + 1:t]))
+            (prev_s, prev_t) = (s, t)
+        self.count("dp_cells", sum(len(g[2]) * len(g[3]) for g in gaps))
+
+        cost = 0
+        alignment = []
+        gap_results = self.gap_map(align_gap, [(g[2], g[3]) for g in gaps])
+        for (i, (gap_cost, gap_alignment)) in enumerate(gap_results):
+            (s_offset, t_offset) = gaps[i][0:2]
+            cost += gap_cost
+            for (s, t) in gap_alignment:
+                alignment.append((s + s_offset if s >= 0 else -1,
+                                  t + t_offset if t >= 0 else -1))
+            if i < len(anchors):
+                alignment.append(anchors[i])
+        return (cost, alignment)
+
+    def count(self, counter, amount=1):
+        if self.stats is not None:
+            self.stats.incr(counter, amount)
+
+    def observe(self, name, value):
+        if self.stats is not None:
+            self.stats.observe(name, value)
+
+    # Lazily maps an alignment of indices back to the tag/chunk streams
+    def iter_alignment(self, alignment, source_stream, target_stream):
+        max_size = max(len(source_stream), len(target_stream))
         for (s, t) in alignment:
             if s >= 0 and t >= 0:
-                result.append((s, source_stream[s], t, target_stream[t], abs(s-t)/max(s_size, t_size)))
+                yield (s, source_stream[s], t, target_stream[t], abs(s-t)/max_size)
             elif s >= 0:
-                result.append((s, source_stream[s], -1, None, -1))
+                yield (s, source_stream[s], -1, None, -1)
             elif t >= 0:
-                result.append((-1, None, t, target_stream[t], -1))
-
-        return result, difference_percentage
+                yield (-1, None, t, target_stream[t], -1)
 
     # Creates maxent instance sets from a set of web page pairs. Source/target
     # docs are arrays of tagchunk streams, and labels is an array of Booleans
@@ -152,33 +290,121 @@ class StrandAligner:
     # aligner. Returns the two arrays as a tuple.
     def tc_to_int(self, source_tcs, target_tcs):
         tag_to_int = {}
-        source = []
-        target = []
-        for s in source_tcs:
-            if s.tc_type == TCType.START:
-                if s.tag not in tag_to_int:
-                    tag_to_int[s.tag] = len(tag_to_int)
-                source.append(2 + tag_to_int[s.tag])
-            elif s.tc_type == TCType.END:
-                if s.tag not in tag_to_int:
-                    tag_to_int[s.tag] = len(tag_to_int)
-                # Assuming there are less than 2^16 unique HTML tags
-                source.append(65536 + tag_to_int[s.tag])
-            elif s.tc_type == TCType.CHUNK:
-                source.append(1)
-        for t in target_tcs:
-            if t.tc_type == TCType.START:
-                if t.tag not in tag_to_int:
-                    tag_to_int[t.tag] = len(tag_to_int)
-                target.append(2 + tag_to_int[t.tag])
-            elif t.tc_type == TCType.END:
-                if t.tag not in tag_to_int:
-                    tag_to_int[t.tag] = len(tag_to_int)
-                target.append(65536 + tag_to_int[t.tag])
-            elif t.tc_type == TCType.CHUNK:
-                target.append(1)
+        source = self.encode_stream(source_tcs, tag_to_int)
+        target = self.encode_stream(target_tcs, tag_to_int)
         return (source, target)
 
+    # Converts an array of tagchunks to an array of integers, adding unseen tags
+    # to the given tag vocabulary. Streams encoded with the same vocabulary can
+    # be aligned against each other.
+    def encode_stream(self, tcs, tag_to_int):
+        result = []
+        for tc in tcs:
+            if tc.tc_type == TCType.START:
+                if tc.tag not in tag_to_int:
+                    tag_to_int[tc.tag] = len(tag_to_int)
+                result.append(2 + tag_to_int[tc.tag])
+            elif tc.tc_type == TCType.END:
+                if tc.tag not in tag_to_int:
+                    tag_to_int[tc.tag] = len(tag_to_int)
+                # Assuming there are less than 2^16 unique HTML tags
+                result.append(65536 + tag_to_int[tc.tag])
+            elif tc.tc_type == TCType.CHUNK:
+                result.append(1)
+        return result
+
+# A hash of two integer sequences after relabeling their tokens in order of
+# first appearance. Sequences which only differ by a consistent renaming of
+# tags (e.g. a different tag vocabulary) get the same key, and have the same
+# alignment since the DP only compares tokens for equality.
+
+
+def sequence_key(source, target):
+    relabel = {1: 1}
+    canonical = array("i")
+    for sequence in (source, target):
+        for x in sequence:
+            if x not in relabel:
+                relabel[x] = len(relabel) + 1
+            canonical.append(relabel[x])
+        canonical.append(0)
+    return hashlib.blake2b(canonical.tobytes(), digest_size=16).digest()
+
+# Returns the anchors of two integer sequences: the longest chain of (source
+# index, target index) pairs of non-chunk tokens occurring exactly once in both
+# sequences, increasing in both indices.
+
+
+def find_anchors(source, target):
+    source_counts = Counter(source)
+    target_counts = Counter(target)
+    target_pos = {}
+    for (t, x) in enumerate(target):
+        if target_counts[x] == 1:
+            target_pos[x] = t
+    candidates = [(s, target_pos[x]) for (s, x) in enumerate(source)
+                  if x != 1 and source_counts[x] == 1 and x in target_pos]
+
+    # Patience sorting for the longest increasing subsequence of target indices
+    tails = []
+    tail_items = []
+    prev = [-1] * len(candidates)
+    for (k, (s, t)) in enumerate(candidates):
+        pos = bisect_left(tails, t)
+        if pos > 0:
+            prev[k] = tail_items[pos - 1]
+        if pos == len(tails):
+            tails.append(t)
+            tail_items.append(k)
+        else:
+            tails[pos] = t
+            tail_items[pos] = k
+    chain = []
+    k = tail_items[-1] if tail_items else -1
+    while k >= 0:
+        chain.append(candidates[k])
+        k = prev[k]
+    chain.reverse()
+    return chain
+
+# The aligner used for gaps between anchors (one per process)
+_gap_aligner = None
+
+# Aligns the (source, target) integer sequences of a gap between anchors
+
+
+def align_gap(gap):
+    global _gap_aligner
+    (source, target) = gap
+    if len(source) == 0 or len(target) == 0:
+        # Only insertions or deletions, no need for the DP
+        return (-(len(source) + len(target)),
+                [(s, -1) for s in range(0, len(source))] + [(-1, t) for t in range(0, len(target))])
+    if _gap_aligner is None:
+        _gap_aligner = py_aligner.PyAligner()
+    return _gap_aligner.align(source, target)
+
+# The fraction of matched (source, target) pairs of the reference alignment
+# which are also matched in the other alignment
+
+
+def path_agreement(reference, other):
+    matched = set((s, t) for (s, t) in reference if s >= 0 and t >= 0)
+    if len(matched) == 0:
+        return 1.0
+    other_matched = set((s, t) for (s, t) in other if s >= 0 and t >= 0)
+    return len(matched & other_matched) / len(matched)
+
+# A tag/chunk stream encoded once against a tag vocabulary which is shared with
+# every stream aligned against it.
+
+
+class PivotStream:
+    def __init__(self, stream, strand_aligner):
+        self.stream = stream
+        self.tag_to_int = {}
+        self.encoded = strand_aligner.encode_stream(stream, self.tag_to_int)
+
 # An enum used by TagChunk
 
 
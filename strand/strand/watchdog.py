@@ -0,0 +1,177 @@
+#!/usr/bin/python
+
+# watchdog.py
+#
+# Per-entry CPU time and memory budgets for strand-align. Entries are aligned
+# in a forked worker process whose resource limits are set before every entry:
+# RLIMIT_CPU stops an entry which runs out of CPU time (SIGXCPU), RLIMIT_AS
+# makes allocations beyond the memory budget fail, and the parent kills the
+# worker if an entry takes longer than a wall clock timeout (for instance when
+# it is stuck outside of the CPU). A worker which went over budget is replaced
+# by a fresh one, and the entry is logged to a reject file.
+
+import math
+import multiprocessing
+import resource
+import signal
+
+from strand.pipeline import Pipeline
+from strand.stats import RunStats
+
+
+# Size of the address space of the current process in bytes (Linux only)
+def address_space():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def set_soft_limit(limit, value):
+    (_, hard) = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, hard))
+
+
+def clear_soft_limit(limit):
+    (_, hard) = resource.getrlimit(limit)
+    resource.setrlimit(limit, (hard, hard))
+
+
+# Main loop of a worker process. Receives (entry number, webpages) and sends
+# back ("ok", results, stats), with the segments of every result materialized,
+# or (reason, None, stats) when the entry could not be aligned.
+def worker_loop(conn, options, cpu_seconds, memory_mb):
+    # Interrupts are handled by the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pipeline = Pipeline(**options)
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            return
+        if item is None:
+            return
+        (entry_num, webpages) = item
+        stats = RunStats()
+        pipeline.use_stats(stats)
+        if cpu_seconds:
+            # RLIMIT_CPU counts whole seconds, so the budget is rounded up
+            set_soft_limit(resource.RLIMIT_CPU, math.ceil(cpu_time() + cpu_seconds))
+        if memory_mb:
+            # Relative to the current address space, which grows with the
+            # segmenters and the DP cache kept between entries
+            set_soft_limit(resource.RLIMIT_AS, address_space() + memory_mb * 1024 * 1024)
+        try:
+            results = pipeline.align_entry_list(webpages, entry_num)
+            message = ("ok", results, stats)
+        except MemoryError:
+            results = None
+            message = ("memory", None, stats)
+        except Exception as e:
+            results = None
+            message = ("error: %s: %s" % (type(e).__name__, e), None, stats)
+        try:
+            conn.send(message)
+        except MemoryError:
+            conn.send(("memory", None, stats))
+        if message[0] != "ok":
+            # The process may be in a bad state after a failed allocation
+            return
+        if memory_mb:
+            # The next entry is received without a limit, then gets its own
+            clear_soft_limit(resource.RLIMIT_AS)
+
+
+class BudgetedWorker:
+    # options are the keyword arguments of the Pipeline. cpu_seconds and
+    # memory_mb are the budgets of a single entry (None for no limit). The wall
+    # clock timeout defaults to twice the CPU budget plus ten seconds.
+    def __init__(self, options, cpu_seconds=None, memory_mb=None, wall_seconds=None, stats=None):
+        self.options = options
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        if wall_seconds is None and cpu_seconds:
+            wall_seconds = 2 * cpu_seconds + 10
+        self.wall_seconds = wall_seconds
+        self.stats = stats if stats is not None else RunStats()
+        self.context = multiprocessing.get_context("fork")
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        (self.conn, child_conn) = self.context.Pipe()
+        self.process = self.context.Process(target=worker_loop, daemon=True,
+                                            args=(child_conn, self.options, self.cpu_seconds, self.memory_mb))
+        self.process.start()
+        child_conn.close()
+        self.stats.incr("worker_starts")
+
+    def stop(self, kill=False):
+        if self.process is None:
+            return
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    # Aligns the webpages of one entry within the budgets. Returns a pair of
+    # the list of PairResults and None, or of None and the reason the entry
+    # was rejected ("cpu", "memory", "timeout", "crash" or an error message).
+    def run(self, webpages, entry_num=-1):
+        if self.process is None:
+            self.start()
+        self.conn.send((entry_num, webpages))
+        if not self.conn.poll(self.wall_seconds):
+            self.stop(kill=True)
+            return (None, "timeout")
+        try:
+            (status, results, entry_stats) = self.conn.recv()
+        except (EOFError, ConnectionResetError):
+            self.process.join()
+            exitcode = self.process.exitcode
+            self.stop(kill=True)
+            if exitcode in (-signal.SIGXCPU, -signal.SIGKILL):
+                return (None, "cpu")
+            return (None, "crash")
+        self.stats.merge(entry_stats)
+        if status != "ok":
+            self.stop()
+            return (None, status)
+        return (results, None)
+
+    def close(self):
+        self.stop()
+
+
+# Logs the entries which went over budget, one tab separated line per entry:
+# entry number, key, reason, seconds, total HTML characters, number of pages
+# and the size of every page (language=characters, comma separated)
+class RejectLog:
+    def __init__(self, path):
+        self.out = open(path, mode="w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, entry_num, key, reason, seconds, webpages):
+        sizes = [(webpage["language"], len(webpage["html"])) for webpage in webpages]
+        print("%d\t%s\t%s\t%.3f\t%d\t%d\t%s" % (
+            entry_num, key, reason, seconds, sum(size for (_, size) in sizes), len(sizes),
+            ",".join("%s=%d" % size for size in sizes)), file=self.out, flush=True)
+        self.count += 1
+
+    def close(self):
+        self.out.close()
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+
+# workqueue.py
+#
+# A work queue for spreading one strand-align run over several processes or
+# machines that only share a filesystem. The queue is a directory:
+#   todo/      chunks of input entries waiting to be aligned (gzipped, in the
+#              strand-align input format), named after the number of their
+#              first entry
+#   claimed/   chunks being aligned, renamed to <item>.<owner> by the worker
+#              which claimed them
+#   done/      chunks which were aligned
+#   out/       the outputs of every chunk (out/<item>/out.<pair>, ...)
+#   manifest.json
+#              written once the input was split: the list of items and the
+#              number of entries
+# Items are claimed by renaming them from todo/ to claimed/, which succeeds
+# for exactly one worker. Outputs are written to a temporary directory which
+# is renamed into out/ when the item is complete. The merge step concatenates
+# the outputs of all items in input order, rewriting the .ann line offsets and
+# the index byte offsets.
+
+import gzip
+import json
+import os
+import shutil
+import socket
+import time
+
+from strand.bitext_index import BitextIndex, BitextIndexWriter, IndexEntry
+
+ITEM_SUFFIX = ".gz"
+OUTPUT_NAME = "out"
+
+
+class WorkQueue:
+    def __init__(self, queue_dir, owner=None):
+        self.queue_dir = queue_dir
+        self.owner = owner or "%s-%d" % (socket.gethostname(), os.getpid())
+        for name in ("todo", "claimed", "done", "out"):
+            os.makedirs(self.path(name), exist_ok=True)
+
+    def path(self, *names):
+        return os.path.join(self.queue_dir, *names)
+
+    def items(self, name):
+        return sorted(item for item in os.listdir(self.path(name)) if not item.startswith("."))
+
+    # Splits the lines of an input file into items of chunk_size entries.
+    # Returns the number of items.
+    def split(self, lines, chunk_size=1000):
+        items = []
+        out = None
+        entries = 0
+        for line in lines:
+            if entries % chunk_size == 0:
+                if out is not None:
+                    out.close()
+                    self.publish(items[-1])
+                items.append("%09d%s" % (entries, ITEM_SUFFIX))
+                out = gzip.open(self.path("todo", "." + items[-1]), "w")
+            out.write(line)
+            entries += 1
+        if out is not None:
+            out.close()
+            self.publish(items[-1])
+        manifest = {"items": items, "entries": entries, "chunk_size": chunk_size}
+        with open(self.path(".manifest.json"), mode="w", encoding="utf-8") as out:
+            json.dump(manifest, out, indent=2)
+        os.rename(self.path(".manifest.json"), self.path("manifest.json"))
+        return len(items)
+
+    def publish(self, item):
+        os.rename(self.path("todo", "." + item), self.path("todo", item))
+
+    def manifest(self):
+        try:
+            with open(self.path("manifest.json"), encoding="utf-8") as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return None
+
+    # The number of the first entry of an item
+    def first_entry(self, item):
+        return int(item[:-len(ITEM_SUFFIX)])
+
+    def claimed_path(self, item):
+        return self.path("claimed", "%s.%s" % (item, self.owner))
+
+    # Claims the first item waiting in todo/, returning its name, or None if
+    # there is none
+    def claim(self):
+        for item in self.items("todo"):
+            try:
+                os.rename(self.path("todo", item), self.claimed_path(item))
+            except FileNotFoundError:
+                # Claimed by another worker first
+                continue
+            if os.path.exists(self.path("out", item)):
+                # Completed by a worker whose claim had been requeued
+                self.finish(item)
+                continue
+            return item
+        return None
+
+    # Marks a claimed item as alive, so that it is not requeued
+    def heartbeat(self, item):
+        try:
+            os.utime(self.claimed_path(item))
+        except FileNotFoundError:
+            pass
+
+    # Moves the items whose claim was not refreshed in max_age seconds (their
+    # worker died) back to todo/. Returns the number of requeued items.
+    def requeue_stale(self, max_age):
+        count = 0
+        now = time.time()
+        for claim in self.items("claimed"):
+            try:
+                if now - os.stat(self.path("claimed", claim)).st_mtime < max_age:
+                    continue
+                item = claim[:claim.index(ITEM_SUFFIX) + len(ITEM_SUFFIX)]
+                os.rename(self.path("claimed", claim), self.path("todo", item))
+                count += 1
+            except FileNotFoundError:
+                continue
+        return count
+
+    # The output prefix to use for a claimed item (in a temporary directory)
+    def output_prefix(self, item):
+        temp_dir = self.path("out", ".%s.%s" % (item, self.owner))
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        os.makedirs(temp_dir)
+        return os.path.join(temp_dir, OUTPUT_NAME)
+
+    # Publishes the outputs of a claimed item and marks it as done
+    def complete(self, item):
+        temp_dir = self.path("out", ".%s.%s" % (item, self.owner))
+        try:
+            os.rename(temp_dir, self.path("out", item))
+        except OSError:
+            # Another worker completed the item first
+            shutil.rmtree(temp_dir)
+        self.finish(item)
+
+    def finish(self, item):
+        try:
+            os.rename(self.claimed_path(item), self.path("done", item))
+        except FileNotFoundError:
+            pass
+
+    # True once the input was split and no item is left to claim. With
+    # wait_claimed, items claimed by other workers must be done as well (they
+    # may be requeued if their worker dies).
+    def finished(self, wait_claimed=False):
+        if self.manifest() is None or len(self.items("todo")) > 0:
+            return False
+        return not wait_claimed or len(self.items("claimed")) == 0
+
+    # Items of the manifest whose outputs are missing
+    def missing(self):
+        manifest = self.manifest()
+        if manifest is None:
+            return None
+        return [item for item in manifest["items"] if not os.path.isdir(self.path("out", item))]
+
+    # Concatenates the outputs of all items into <out_prefix>.<pair>,
+    # <out_prefix>.<pair>.ann and so on. Returns the list of pair codes.
+    def merge(self, out_prefix):
+        missing = self.missing()
+        if missing is None:
+            raise Exception("The input was not split yet: %s" % self.queue_dir)
+        if len(missing) > 0:
+            raise Exception("%d items are not done yet: %s" % (len(missing), ", ".join(missing[:10])))
+        item_dirs = [self.path("out", item) for item in self.manifest()["items"]]
+        pairs = set()
+        for item_dir in item_dirs:
+            for name in os.listdir(item_dir):
+                if name.startswith(OUTPUT_NAME + ".") and name.endswith(".ann"):
+                    pairs.add(name[len(OUTPUT_NAME) + 1:-len(".ann")])
+        for pair in sorted(pairs):
+            merge_pair(["%s.%s" % (os.path.join(item_dir, OUTPUT_NAME), pair) for item_dir in item_dirs],
+                       "%s.%s" % (out_prefix, pair))
+        concatenate([os.path.join(item_dir, OUTPUT_NAME + ".rejects") for item_dir in item_dirs],
+                     "%s.rejects" % out_prefix)
+        return sorted(pairs)
+
+
+# Concatenates the existing files among paths, if there are any
+def concatenate(paths, out_path):
+    paths = [path for path in paths if os.path.exists(path)]
+    if len(paths) == 0:
+        return
+    with open(out_path, mode="wb") as out:
+        for path in paths:
+            with open(path, mode="rb") as f:
+                shutil.copyfileobj(f, out)
+
+
+# Merges the outputs of one language pair. The bitext files are
+# concatenated, the line offsets of the .ann files are shifted by the number
+# of bitext lines before them, and the index records are rebased on the
+# merged files.
+def merge_pair(prefixes, out_prefix):
+    prefixes = [prefix for prefix in prefixes if os.path.exists(prefix)]
+    with_index = all(os.path.exists(prefix + ".idx") for prefix in prefixes)
+    index_out = BitextIndexWriter(out_prefix + ".idx") if with_index else None
+    with open(out_prefix, mode="wb") as bi_out, open(out_prefix + ".ann", mode="wb") as ann_out:
+        line_base = 0
+        for prefix in prefixes:
+            bi_base = bi_out.tell()
+            with open(prefix, mode="rb") as bi_in:
+                shutil.copyfileobj(bi_in, bi_out)
+            index = BitextIndex(prefix + ".idx") if with_index else None
+            with open(prefix + ".ann", mode="rb") as ann_in:
+                lines = ann_in.read().split(b"\n")[:-1]
+            if index is not None and len(index) != len(lines):
+                raise Exception("The index of %s does not match its annotations" % prefix)
+            num_lines = 0
+            for (i, line) in enumerate(lines):
+                fields = line.split(b"\t")
+                fields[2] = b"%d" % (int(fields[2]) + line_base)
+                ann_start = ann_out.tell()
+                ann_out.write(b"\t".join(fields) + b"\n")
+                num_lines = max(num_lines, int(fields[2]) + int(fields[3]) - line_base)
+                if index is not None:
+                    entry = index[i]
+                    index_out.add_entry(IndexEntry(entry.key_hash, entry.bi_offset + bi_base, entry.bi_length,
+                                                   ann_start, ann_out.tell() - ann_start,
+                                                   entry.num_alignments, entry.line_offset + line_base))
+            if index is not None:
+                index.close()
+            line_base += num_lines
+    if index_out is not None:
+        index_out.close()
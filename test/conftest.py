@@ -0,0 +1,72 @@
+import gzip
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+STRAND_ALIGN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "strand", "strand-align")
+
+WORDS = {"en": "the house of the bull legend agave field night soul".split(),
+         "ja": "家 伝説 雄牛 畑 夜 魂 アガベ 大地".split(),
+         "fr": "la maison du taureau légende champ nuit âme".split()}
+
+
+# A synthetic web page of num_blocks text blocks in the given language. Pages
+# generated with the same seed share their layout.
+def make_page(lang, num_blocks, seed):
+    r = random.Random(seed)
+    body = ["<html><head><title>Site %s</title></head><body>" % lang,
+            '<div class="nav"><a href="http://site.com/%s/home">Home</a> '
+            '<a href="http://site.com/%s/about">About</a></div>' % (lang, lang)]
+    for _ in range(num_blocks):
+        sentences = " ".join(" ".join(r.choice(WORDS[lang]) for _ in range(r.randint(3, 9)))
+                             + ("。" if lang == "ja" else ".") for _ in range(r.randint(1, 3)))
+        tag = r.choice(["p", "li", "h2", "td"])
+        body.append("<div><%s>%s</%s></div>" % (tag, sentences, tag))
+    body.append("<div>English / 日本語</div></body></html>")
+    return "".join(body)
+
+
+# Writes a gzipped strand-align input file of num_entries entries of very
+# different sizes, some with a French page besides the Japanese one
+def write_input(path, num_entries=15, seed=7):
+    r = random.Random(seed)
+    with gzip.open(path, "wt", encoding="utf-8") as out:
+        for entry in range(num_entries):
+            num_blocks = r.choice([3, 10, 20, 60])
+            langs = ["en", "ja", "fr"] if entry % 3 == 0 else ["en", "ja"]
+            fields = ["key%d" % entry]
+            for lang in langs:
+                fields += [lang, "http://site.com/%s/page%d" % (lang, entry),
+                           make_page(lang, num_blocks, entry)]
+            out.write("\t".join(fields) + "\n")
+    return path
+
+
+@pytest.fixture
+def sample_input(tmp_path):
+    return write_input(str(tmp_path / "input.gz"))
+
+
+def strand_align(*args):
+    return subprocess.run([sys.executable, STRAND_ALIGN] + [str(arg) for arg in args],
+                          check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def strand_align_process(*args):
+    return subprocess.Popen([sys.executable, STRAND_ALIGN] + [str(arg) for arg in args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+# The contents of every output file of a run, keyed on the file name without
+# the output prefix
+def read_outputs(out_prefix):
+    (out_dir, name) = os.path.split(out_prefix)
+    outputs = {}
+    for file_name in sorted(os.listdir(out_dir)):
+        if file_name.startswith(name + "."):
+            with open(os.path.join(out_dir, file_name), mode="rb") as f:
+                outputs[file_name[len(name):]] = f.read()
+    return outputs
@@ -0,0 +1,79 @@
+import multiprocessing
+import random
+
+from functools import partial
+
+import py_aligner
+import pytest
+
+from strand.strand import StrandAligner
+
+
+# The score of an alignment path with the costs of the STRAND DP: 0 for a
+# match, -2 for a mismatch and -1 for a gap
+def path_cost(source, target, alignment):
+    cost = 0
+    for (s, t) in alignment:
+        if s < 0 or t < 0:
+            cost -= 1
+        elif source[s] != target[t]:
+            cost -= 2
+    return cost
+
+
+# A pair of tag sequences sharing a template: common tags (which occur many
+# times), unique tags (which become anchors) and chunk lengths, with some
+# tokens dropped or replaced on either side
+def make_pair(seed, length=200):
+    r = random.Random(seed)
+    template = []
+    for i in range(length):
+        if r.random() < 0.1:
+            template.append(1000 + i)
+        else:
+            template.append(r.randint(1, 12))
+
+    def variant():
+        tokens = []
+        for token in template:
+            x = r.random()
+            if x < 0.08:
+                continue
+            if x < 0.12:
+                tokens.append(r.randint(1, 12))
+            tokens.append(token)
+        return tokens
+    return (variant(), variant())
+
+
+def check_alignment(source, target, cost, alignment):
+    assert [s for (s, _) in alignment if s >= 0] == list(range(len(source)))
+    assert [t for (_, t) in alignment if t >= 0] == list(range(len(target)))
+    assert all(s >= 0 or t >= 0 for (s, t) in alignment)
+    assert cost == path_cost(source, target, alignment)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_anchored_align_is_complete_and_never_better_than_full_dp(seed):
+    (source, target) = make_pair(seed)
+    (cost, alignment) = StrandAligner(anchored=True).anchored_align(source, target)
+    check_alignment(source, target, cost, alignment)
+    (full_cost, _) = py_aligner.PyAligner().align(source, target)
+    assert cost <= full_cost
+
+
+@pytest.mark.parametrize("pair", [([], []), ([1, 2, 3], []), ([], [4, 5]), ([7], [7]),
+                                  ([1, 2, 3], [3, 2, 1]), ([5, 6, 7, 8], [5, 6, 7, 8])])
+def test_anchored_align_edge_cases(pair):
+    (source, target) = pair
+    (cost, alignment) = StrandAligner(anchored=True).anchored_align(source, target)
+    check_alignment(source, target, cost, alignment)
+    assert cost <= py_aligner.PyAligner().align(source, target)[0]
+
+
+def test_anchored_align_in_a_pool_matches_map():
+    pairs = [make_pair(seed) for seed in range(5)]
+    expected = [StrandAligner(anchored=True).anchored_align(s, t) for (s, t) in pairs]
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        aligner = StrandAligner(anchored=True, gap_map=partial(pool.imap, chunksize=4))
+        assert [aligner.anchored_align(s, t) for (s, t) in pairs] == expected
@@ -0,0 +1,93 @@
+import base64
+import hashlib
+import os
+
+from collections import Counter
+
+from conftest import strand_align
+from strand.dedup import BloomFilter, CountMinSketch, PairDeduplicator
+
+
+def digest(i):
+    return hashlib.blake2b(b"%d" % i, digest_size=16).digest()
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    # Unique digests are (almost always) reported as new, repeated ones always
+    # as present
+    assert sum(1 for i in range(1000) if bloom.add(digest(i))) < 30
+    assert all(bloom.add(digest(i)) for i in range(1000))
+    # About error_rate of the new digests are false positives at capacity
+    assert sum(1 for i in range(1000, 1200) if bloom.add(digest(i))) < 10
+
+
+def test_count_min_sketch_never_underestimates():
+    sketch = CountMinSketch(width=64, depth=3)
+    counts = Counter({i: i % 7 + 1 for i in range(200)})
+    for (i, count) in counts.items():
+        for _ in range(count):
+            sketch.add(digest(i))
+    assert all(sketch.estimate(digest(i)) >= count for (i, count) in counts.items())
+    wide = CountMinSketch(width=1 << 16, depth=4)
+    for (i, count) in counts.items():
+        for _ in range(count):
+            wide.add(digest(i))
+    assert all(wide.estimate(digest(i)) == count for (i, count) in counts.items())
+
+
+def test_pair_deduplicator_drops_repeated_pairs():
+    dedup = PairDeduplicator(capacity=1000, count=True)
+    assert dedup.check("ja-en", "家", "house")
+    assert dedup.check("ja-en", "夜", "night")
+    # The same sentences in another language pair are a different pair
+    assert dedup.check("fr-en", "家", "house")
+    assert not dedup.check("ja-en", "家", "house")
+    assert not dedup.check("ja-en", "家", "house")
+    assert (dedup.written, dedup.dropped) == (3, 2)
+    assert dedup.sketch.estimate(dedup.digest("ja-en", "家", "house")) == 3
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8", newline="\n") as f:
+        return f.read().split("\n")[:-1]
+
+
+def bitext_pairs(lines, b64=False):
+    pairs = []
+    for line in lines:
+        fields = line.split("\t")
+        if b64:
+            fields = [base64.b64decode(field).decode("utf-8") if i in (1, 3) else field
+                      for (i, field) in enumerate(fields)]
+        pairs.append((fields[1], fields[3]))
+    return pairs
+
+
+def test_dedup_outputs(tmp_path, sample_input):
+    for name in ("full", "dedup", "dedup64"):
+        os.makedirs(str(tmp_path / name))
+    strand_align("-i", sample_input, "-o", tmp_path / "full" / "out")
+    strand_align("-i", sample_input, "-o", tmp_path / "dedup" / "out", "--dedup", "--dedup-freq")
+    strand_align("-i", sample_input, "-o", tmp_path / "dedup64" / "out", "--dedup", "--dedup-freq", "-ob64")
+    for pair in ("fr-en", "ja-en"):
+        full = Counter(bitext_pairs(read_lines(str(tmp_path / "full" / ("out." + pair)))))
+        for (name, b64) in (("dedup", False), ("dedup64", True)):
+            prefix = str(tmp_path / name / ("out." + pair))
+            lines = read_lines(prefix)
+            pairs = bitext_pairs(lines, b64)
+            # Repeated pairs are dropped, every distinct pair is kept once
+            assert len(full) < sum(full.values())
+            assert pairs == list(dict.fromkeys(pairs))
+            assert set(pairs) == set(full)
+            # The annotations cover the deduplicated bitext without gaps
+            offset = 0
+            for line in read_lines(prefix + ".ann"):
+                fields = line.split("\t")
+                assert int(fields[2]) == offset
+                assert int(fields[3]) > 0
+                offset += int(fields[3])
+            assert offset == len(lines)
+            # One (exact, given the sketch size) count per bitext line
+            frequencies = [int(count) for count in read_lines(prefix + ".freq")]
+            assert frequencies == [full[p] for p in pairs]
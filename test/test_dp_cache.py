@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from strand.strand import StrandAligner, sequence_key
+
+
+# A pair of tag sequences built from the same template; 1 is a text chunk
+def make_pair(r, length=60, vocabulary=8):
+    template = [r.choice([1, 1] + list(range(2, 2 + vocabulary))) for _ in range(length)]
+    source = [x for x in template if r.random() > 0.1]
+    target = [x if r.random() > 0.1 else r.randint(2, 1 + vocabulary) for x in template]
+    return (source, target)
+
+
+# Consistently renames the tags (every token but the chunk token 1)
+def rename(pair, seed):
+    tags = sorted((set(pair[0]) | set(pair[1])) - {1})
+    new_tags = random.Random(seed).sample(range(100, 100000), len(tags))
+    mapping = dict(zip(tags, new_tags))
+    mapping[1] = 1
+    return tuple([mapping[x] for x in sequence] for sequence in pair)
+
+
+def test_sequence_key_ignores_consistent_renaming():
+    r = random.Random(1)
+    for seed in range(20):
+        pair = make_pair(r)
+        renamed = rename(pair, seed)
+        assert renamed != pair
+        assert sequence_key(*renamed) == sequence_key(*pair)
+
+
+def test_sequence_key_separates_different_structures():
+    r = random.Random(2)
+    (source, target) = make_pair(r)
+    key = sequence_key(source, target)
+    # The same tag renamed on one side only
+    tag = next(x for x in source if x != 1)
+    assert sequence_key([x + 1000 if x == tag else x for x in source], target) != key
+    # Two tokens swapped
+    i = next(i for i in range(len(source) - 1) if source[i] != source[i + 1])
+    swapped = source[:i] + [source[i + 1], source[i]] + source[i + 2:]
+    assert sequence_key(swapped, target) != key
+    # A token moved from the end of the source to the start of the target
+    assert sequence_key(source[:-1], source[-1:] + target) != key
+    # A tag replaced by a chunk
+    assert sequence_key([1 if x == tag else x for x in source], target) != key
+
+
+@pytest.mark.parametrize("anchored", [False, True])
+def test_cached_dp_align_matches_uncached(anchored):
+    r = random.Random(3)
+    pairs = [make_pair(r) for _ in range(6)]
+    # Repeated and renamed pairs hit the cache, and the small cache evicts
+    requests = pairs + [rename(pair, i) for (i, pair) in enumerate(pairs)] + pairs[::-1]
+    uncached = StrandAligner(anchored=anchored)
+    cached = StrandAligner(anchored=anchored, cache_size=4)
+    for (source, target) in requests:
+        assert cached.dp_align(source, target) == uncached.dp_align(source, target)
+    (hits, misses, size) = cached.cache_info()
+    assert hits > 0 and misses > len(pairs) and size == 4
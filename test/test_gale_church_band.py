@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from py_aligner import PyGaleChurchAligner
+
+
+def make_sentences(r, count):
+    return ["x" * r.randint(5, 120) for _ in range(count)]
+
+
+# A document and its translation: sentence lengths are scaled with some noise,
+# and a few sentences are merged, split or left out
+def make_documents(seed, count=80):
+    r = random.Random(seed)
+    source = make_sentences(r, count)
+    target = []
+    i = 0
+    while i < len(source):
+        x = r.random()
+        if x < 0.05:
+            i += 1
+            continue
+        if x < 0.1 and i + 1 < len(source):
+            target.append("y" * int((len(source[i]) + len(source[i + 1])) * 1.1))
+            i += 2
+            continue
+        if x < 0.15:
+            half = len(source[i]) // 2 + 1
+            target += ["y" * half, "y" * half]
+        else:
+            target.append("y" * max(1, int(len(source[i]) * r.uniform(0.8, 1.3))))
+        i += 1
+    return (source, target)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_large_band_equals_full_grid(seed):
+    (source, target) = make_documents(seed)
+    aligner = PyGaleChurchAligner()
+    assert aligner.align(source, target, 1000) == aligner.align(source, target, 0)
+    assert aligner.align(source, target, len(source) + len(target)) == aligner.align(source, target)
+
+
+# The aligned sentences of a bead list, in order, with the sentence
+# separators removed. The traceback stops at the first row or column, so
+# leading unaligned sentences may be left out (with or without a band).
+def joined(sentences):
+    return "".join(sentences).replace(" ", "")
+
+
+@pytest.mark.parametrize("band", [1, 3, 10])
+def test_narrow_band_is_never_better_than_full_grid(band):
+    (source, target) = make_documents(3)
+    aligner = PyGaleChurchAligner()
+    (cost, aligned_source, aligned_target) = aligner.align(source, target, band)
+    assert cost <= aligner.align(source, target, 0)[0]
+    assert len(aligned_source) == len(aligned_target)
+    assert "".join(source).endswith(joined(aligned_source))
+    assert "".join(target).endswith(joined(aligned_target))
+
+
+def test_band_narrower_than_length_difference():
+    r = random.Random(1)
+    (source, target) = (make_sentences(r, 40), make_sentences(r, 5))
+    aligner = PyGaleChurchAligner()
+    assert aligner.align(source, target, 2) == aligner.align(source, target, 0)
+
+
+# The band is widened by the slope of the diagonal, so the end of the grid can
+# be reached when the target is much longer than the source
+@pytest.mark.parametrize("band", [1, 2, 5])
+def test_band_with_much_longer_target(band):
+    r = random.Random(1)
+    (source, target) = (make_sentences(r, 5), make_sentences(r, 40))
+    aligner = PyGaleChurchAligner()
+    (cost, aligned_source, aligned_target) = aligner.align(source, target, band)
+    assert -1e300 < cost <= aligner.align(source, target, 0)[0]
+    assert len(aligned_source) == len(aligned_target) > 0
+    assert "".join(source).endswith(joined(aligned_source))
+    assert "".join(target).endswith(joined(aligned_target))
@@ -0,0 +1,14 @@
+import os
+
+from conftest import read_outputs, strand_align
+
+
+def test_several_workers_match_one_worker(tmp_path, sample_input):
+    outputs = []
+    for (name, args) in (("one", ["--workers", 1]),
+                         ("three", ["--workers", 3, "--read-ahead", 4])):
+        os.makedirs(str(tmp_path / name))
+        strand_align("-i", sample_input, "-o", tmp_path / name / "out", "--index", *args)
+        outputs.append(read_outputs(str(tmp_path / name / "out")))
+    assert len(outputs[0]) == 6
+    assert outputs[1] == outputs[0]
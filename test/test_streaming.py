@@ -0,0 +1,31 @@
+import gzip
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import STRAND_ALIGN, read_outputs, strand_align
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_stream_matches_file_outputs(tmp_path, sample_input, compressed):
+    os.makedirs(str(tmp_path / "files"))
+    strand_align("-i", sample_input, "-o", tmp_path / "files" / "out")
+    outputs = read_outputs(str(tmp_path / "files" / "out"))
+
+    with open(sample_input, mode="rb") as f:
+        data = f.read()
+    if not compressed:
+        data = gzip.decompress(data)
+    stream = subprocess.run([sys.executable, STRAND_ALIGN, "-i", "-", "-o", "-"], input=data,
+                            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+
+    records = {}
+    for line in stream.split(b"\n")[:-1]:
+        (record_type, pair, value) = line.split(b"\t", 2)
+        assert record_type in (b"B", b"A")
+        suffix = "." + pair.decode("utf-8") + (".ann" if record_type == b"A" else "")
+        records[suffix] = records.get(suffix, b"") + value + b"\n"
+    assert sorted(records) == [".fr-en", ".fr-en.ann", ".ja-en", ".ja-en.ann"]
+    assert records == outputs
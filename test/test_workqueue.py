@@ -0,0 +1,25 @@
+import os
+
+from conftest import read_outputs, strand_align, strand_align_process
+
+
+def test_queue_run_matches_single_run(tmp_path, sample_input):
+    os.makedirs(str(tmp_path / "single"))
+    os.makedirs(str(tmp_path / "merged"))
+    strand_align("-i", sample_input, "-o", tmp_path / "single" / "out", "--index")
+
+    queue_dir = tmp_path / "queue"
+    strand_align("--queue-dir", queue_dir, "--queue-role", "split", "-i", sample_input,
+                 "--chunk-size", 2)
+    workers = [strand_align_process("--queue-dir", queue_dir, "--queue-role", "work", "--index")
+               for _ in range(3)]
+    for worker in workers:
+        (_, errors) = worker.communicate(timeout=600)
+        assert worker.returncode == 0, errors
+    strand_align("--queue-dir", queue_dir, "--queue-role", "merge", "-o", tmp_path / "merged" / "out")
+
+    single = read_outputs(str(tmp_path / "single" / "out"))
+    merged = read_outputs(str(tmp_path / "merged" / "out"))
+    assert sorted(single) == [".fr-en", ".fr-en.ann", ".fr-en.idx", ".ja-en", ".ja-en.ann", ".ja-en.idx"]
+    assert merged == single
+    assert len(os.listdir(str(queue_dir / "done"))) == 8